@@ -0,0 +1,115 @@
+from flask import current_app, g, redirect, url_for
+from flask_admin import expose
+from flask_admin.contrib.sqla import ModelView
+from flask_login import current_user
+from sqlalchemy import literal, text
+from cache import MemoryBackend
+from replica import read_only
+from search import search as full_text
+
+
+ESTIMATE_QUERY = text('''
+    SELECT CAST(reltuples AS bigint) FROM pg_class
+    WHERE oid = CAST(:table AS regclass)
+''')
+
+
+class AdminView(ModelView):
+    '''List views that stay fast on big tables.
+
+    Pages are read by id, in keyset style: the last id of every page
+    served is remembered, so moving to the next page filters on
+    id > last id instead of scanning OFFSET rows. Pages reached without
+    that memo (a jump, another sort) fall back to OFFSET. Unfiltered
+    lists of tables with more than ADMIN_COUNT_ESTIMATE_THRESHOLD rows
+    show the planner's row estimate instead of running COUNT(*).
+    Search uses the full text index rather than ILIKE.
+    '''
+    column_default_sort = ('id', False)
+    page_size = 50
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.page_memo = MemoryBackend(max_entries=1024, ttl=600)
+
+    def is_accessible(self):
+        return current_user.is_authenticated
+
+    def inaccessible_callback(self, name, **kwargs):
+        return redirect(url_for('login'))
+
+    @expose('/')
+    @read_only
+    def index_view(self):
+        return super().index_view()
+
+    def estimated_count(self):
+        if self.session.get_bind().dialect.name != 'postgresql':
+            return None
+
+        estimate = self.session.execute(
+            ESTIMATE_QUERY, {'table': self.model.__tablename__}).scalar()
+        threshold = current_app.config['ADMIN_COUNT_ESTIMATE_THRESHOLD']
+        # reltuples is -1 (or 0) until the table is first analyzed
+        if estimate is None or estimate < threshold:
+            return None
+        return estimate
+
+    def get_list(self, page, sort_column, sort_desc, search, filters,
+                 execute=True, page_size=None):
+        if page_size is None:
+            page_size = self.page_size
+        keyset = sort_column is None and bool(page_size) and execute
+        signature = repr((search, [tuple(f) for f in filters or ()],
+                          page_size))
+
+        g.admin_after_id = None
+        if keyset and page:
+            found, last_id = self.page_memo.get(f'{signature}:{page - 1}')
+            if found:
+                g.admin_after_id = last_id
+        g.admin_estimated_count = None
+        if not search and not filters:
+            g.admin_estimated_count = self.estimated_count()
+
+        count, rows = super().get_list(page, sort_column, sort_desc, search,
+                                       filters, execute, page_size)
+
+        if keyset and rows:
+            self.page_memo.set(f'{signature}:{page}', rows[-1].id)
+        return count, rows
+
+    def get_count_query(self):
+        estimate = g.pop('admin_estimated_count', None)
+        if estimate is not None:
+            return self.session.query(literal(estimate))
+        return super().get_count_query()
+
+    def _apply_pagination(self, query, page, page_size):
+        after_id = g.pop('admin_after_id', None)
+        if after_id is None:
+            return super()._apply_pagination(query, page, page_size)
+        return query.filter(self.model.id > after_id).limit(page_size)
+
+    def _apply_search(self, query, count_query, joins, count_joins, term):
+        clause = full_text.match(self.model, term)
+        query = query.filter(clause)
+        if count_query is not None:
+            count_query = count_query.filter(clause)
+        return query, count_query, joins, count_joins
+
+
+class RestaurantAdminView(AdminView):
+    column_exclude_list = ('menu_document',)
+    column_searchable_list = ('name', 'description')
+    column_filters = ('city', 'state')
+    # maintained by the session hooks in models.py
+    form_excluded_columns = ('menu_document', 'revision', 'updated_at')
+
+
+class ItemAdminView(AdminView):
+    column_list = ('restaurant', 'section', 'name', 'price', 'categories')
+    column_searchable_list = ('name', 'section', 'shortDescription')
+    column_filters = ('restaurant.slug', 'section', 'price')
+    column_select_related_list = ('restaurant',)
+    form_excluded_columns = ('revision', 'updated_at')
@@ -1,26 +1,36 @@
 import sys
 import os
+import io
+import csv
 import json
+import hashlib
+import time
 from flask import (Flask, request, abort, render_template,
-                   url_for, redirect, Response, jsonify, session, flash)
-from datetime import timedelta
+                   url_for, redirect, Response, jsonify, session, flash,
+                   stream_with_context)
+from datetime import timezone
 from sqlalchemy.exc import (
     IntegrityError, DataError, DatabaseError, InterfaceError, InvalidRequestError)
 from werkzeug.routing import BuildError
-from flask_bcrypt import Bcrypt, generate_password_hash, check_password_hash
 from flask_login import (UserMixin, login_user, LoginManager,
                          current_user, logout_user, login_required)
 from forms import login_form, register_form
 from flask_bcrypt import Bcrypt
-from models import setup_db, Restaurant, Item, User
-from flask_sqlalchemy import SQLAlchemy
+from models import (setup_db, db, Restaurant, Item, User, parse_price,
+                    parse_price_cursor, validate_item, user_cache)
+from search import search
+from events import menu_events
+from metrics import init_metrics
+from compression import init_compression, etag_variants
+from replica import read_only
+from serializers import dumps, json_response
+from passwords import passwords, PasswordHasherBusy
 from flask_migrate import Migrate
 from flask_admin import Admin
-from flask_admin.contrib.sqla import ModelView
+from admin_views import RestaurantAdminView, ItemAdminView
 from config import Config
 
 
-db = SQLAlchemy()
 migrate = Migrate()
 bcrypt = Bcrypt()
 login_manager = LoginManager()
@@ -29,34 +39,191 @@ login_manager.login_view = 'login'
 login_manager.login_message_category = 'info'
 
 
-class AdminView(ModelView):
-    def is_accessible(self):
-        return current_user.is_authenticated
+def get_int_arg(name, default=None):
+    value = request.args.get(name)
+    if value is None:
+        return default
 
-    def inaccessible_callback(self, name, **kwargs):
-        return redirect(url_for('login'))
+    try:
+        return int(value)
+    except ValueError:
+        abort(400)
+
+
+def get_limit_arg():
+    limit = get_int_arg('limit', Config.PAGE_SIZE)
+
+    if limit < 1:
+        abort(400)
+
+    return min(limit, Config.MAX_PAGE_SIZE)
+
+
+def get_page_args():
+    return get_limit_arg(), get_int_arg('after')
+
+
+def get_price_args():
+    try:
+        min_price = parse_price(request.args.get('min_price'))
+        max_price = parse_price(request.args.get('max_price'))
+    except ValueError:
+        abort(400)
+
+    sort = request.args.get('sort', 'id')
+    if sort not in ('id', 'price'):
+        abort(400)
+
+    return min_price, max_price, sort
+
+
+def wants_ndjson():
+    if request.args.get('stream'):
+        return True
+
+    best = request.accept_mimetypes.best_match(
+        ['application/json', 'application/x-ndjson'])
+    return best == 'application/x-ndjson'
+
+
+def get_fields_arg(model):
+    '''Sparse fieldset from ?fields=id,name,price, or None for every
+    field.'''
+    fields = request.args.get('fields')
+    if fields is None:
+        return None
+
+    fields = tuple(field.strip() for field in fields.split(',') if field.strip())
+    if not fields or not set(fields) <= set(model.public_fields):
+        abort(400)
+    return fields
+
+
+def get_list_arg(name, type=str):
+    '''Comma separated values of a query argument, without duplicates, or
+    None when it is absent. Aborts with 400 on bad or too many values.'''
+    value = request.args.get(name)
+    if value is None:
+        return None
+
+    values = []
+    for part in value.split(','):
+        part = part.strip()
+        if not part:
+            continue
+        try:
+            part = type(part)
+        except ValueError:
+            abort(400)
+        if part not in values:
+            values.append(part)
+
+    if not values or len(values) > Config.MAX_BATCH_LOOKUP:
+        abort(400)
+    return values
+
+
+def generate_export(batch_size):
+    for restaurant in Restaurant.iter_all_restaurants(batch_size):
+        yield dumps({'Restaurant': restaurant}) + b'\n'
+
+    for item in Item.iter_all_items(batch_size):
+        yield dumps({'Item': item}) + b'\n'
+
+
+def conditional_response(version, last_modified, build_response):
+    '''Answer a GET with 304 when the client already holds the current
+    version, otherwise build the response and tag it. build_response is
+    only called when the body is actually needed.'''
+    etag = hashlib.sha1(
+        f'{request.full_path}:{version}'.encode('utf-8')).hexdigest()
+    if last_modified is not None:
+        last_modified = last_modified.replace(
+            microsecond=0, tzinfo=timezone.utc)
+
+    if request.if_none_match:
+        matched = [tag for tag in etag_variants(etag)
+                   if request.if_none_match.contains(tag)]
+        not_modified = bool(matched)
+    else:
+        not_modified = (last_modified is not None and
+                        request.if_modified_since is not None and
+                        last_modified <= request.if_modified_since)
+
+    if not_modified:
+        response = Response(status=304)
+        if request.if_none_match:
+            etag = matched[0]
+    else:
+        response = build_response()
+
+    response.set_etag(etag)
+    response.last_modified = last_modified
+    return response
+
+
+def read_bulk_rows():
+    '''Rows for a bulk import, from a JSON array, a text/csv body or a
+    CSV file uploaded as "file". CSV categories are separated by "|".'''
+    upload = request.files.get('file')
+    if upload is not None:
+        text = upload.read().decode('utf-8-sig')
+    elif request.mimetype == 'text/csv':
+        text = request.get_data(as_text=True)
+    else:
+        rows = request.get_json(silent=True)
+        if not isinstance(rows, list):
+            abort(400)
+        return rows
+
+    rows = []
+    for row in csv.DictReader(io.StringIO(text)):
+        if row.get('categories'):
+            row['categories'] = [category.strip()
+                                 for category in row['categories'].split('|')
+                                 if category.strip()]
+        rows.append(row)
+    return rows
 
 
 def create_app(test_config=None):
     app = Flask(__name__)
     app.config.from_object(Config)
+    if test_config is not None:
+        app.config.update(test_config)
     setup_db(app)
+    search.init_app(app)
+    menu_events.init_app(app)
+    if app.config['METRICS_ENABLED']:
+        init_metrics(app)
+    if app.config['COMPRESS_ENABLED']:
+        init_compression(app)
     migrate.init_app(app, db)
     bcrypt.init_app(app)
+    passwords.init_app(app)
     admin = Admin(app)
     login_manager.init_app(app)
 
-    admin.add_view(AdminView(Restaurant, db.session))
-    admin.add_view(AdminView(Item, db.session))
+    admin.add_view(RestaurantAdminView(Restaurant, db.session))
+    admin.add_view(ItemAdminView(Item, db.session))
 
     @login_manager.user_loader
     def load_user(user_id):
-        return User.query.get(int(user_id))
+        return user_cache.get(int(user_id))
 
     @app.before_request
     def session_handler():
-        session.permanent = True
-        app.permanent_session_lifetime = timedelta(minutes=1)
+        '''Sessions are permanent and slide, but the cookie is only sent
+        again once less than SESSION_REFRESH_REMAINING of the lifetime
+        is left, not on every request.'''
+        if not session.permanent:
+            session.permanent = True
+
+        lifetime = app.permanent_session_lifetime.total_seconds()
+        remaining = app.config['SESSION_REFRESH_REMAINING']
+        now = time.time()
+        if now - session.get('_refreshed_at', 0) > lifetime * (1 - remaining):
+            session['_refreshed_at'] = now
 
     @app.route('/', methods=['GET', 'POST'], strict_slashes=False)
     def index():
@@ -69,12 +236,23 @@ def create_app(test_config=None):
         if form.validate_on_submit():
             try:
                 user = User.query.filter_by(email=form.email.data).first()
-                if check_password_hash(user.password, form.password.data):
+                if user is not None and passwords.verify(
+                        user.password, form.password.data):
+                    if passwords.needs_rehash(user.password):
+                        try:
+                            user.password = passwords.hash(
+                                form.password.data)
+                            user.update()
+                        except PasswordHasherBusy:
+                            # the password is checked; rehash next time
+                            pass
                     login_user(user)
                     flash('Login Successfull!')
                     return redirect(url_for('admin.index'))
                 else:
                     flash('Invalid Username or password!', 'danger')
+            except PasswordHasherBusy:
+                abort(503)
             except Exception as e:
                 flash(e, 'danger')
 
@@ -99,7 +277,7 @@ def create_app(test_config=None):
                 newuser = User(
                     username=username,
                     email=email,
-                    password=bcrypt.generate_password_hash(password),
+                    password=passwords.hash(password),
                 )
 
                 db.session.add(newuser)
@@ -109,6 +287,8 @@ def create_app(test_config=None):
 
                 return redirect(url_for('login'))
 
+            except PasswordHasherBusy:
+                abort(503)
             except InvalidRequestError:
                 db.session.rollback()
                 flash(f'Something went wrong!', 'danger')
@@ -142,32 +322,220 @@ def create_app(test_config=None):
         return redirect(url_for('admin.index'))
 
     @app.route('/api')
+    @read_only
     def api_test():
-        return jsonify(
+        if wants_ndjson():
+            return Response(
+                stream_with_context(
+                    generate_export(app.config['EXPORT_BATCH_SIZE'])),
+                mimetype='application/x-ndjson'
+            )
+
+        version = Restaurant.get_catalog_version()
+        return json_response(
             {
-                'Restaurants': Restaurant.get_all_restaurants(),
-                'Items': Item.get_all_items()
+                'Restaurants': Restaurant.get_all_restaurants(version),
+                'Items': Item.get_all_items(version)
             }
         )
 
     @app.route('/restaurants/<slug>')
+    @read_only
     def get_restaurant_by_slug(slug):
-        return jsonify(
-            {
-                'Restaurant': Restaurant.get_restaurant(slug)
-            }
-        )
+        version = Restaurant.get_version(slug)
+        if version is None:
+            abort(404)
+
+        def build_response():
+            # the restaurant may be deleted after the version check
+            restaurant = Restaurant.get_restaurant(version)
+            if restaurant is None:
+                abort(404)
+
+            return json_response(
+                {
+                    'Restaurant': restaurant
+                }
+            )
+
+        return conditional_response(
+            tuple(version), version.updated_at, build_response)
+
+    @app.route('/restaurants/<slug>/menu')
+    @read_only
+    def get_restaurant_menu(slug):
+        version = Restaurant.get_version(slug)
+        if version is None:
+            abort(404)
+
+        min_price, max_price, sort = get_price_args()
+        since = get_int_arg('since')
+        if since is not None and since < 0:
+            abort(400)
+
+        def build_response():
+            if since is not None:
+                return json_response(Restaurant.get_menu_changes(slug, since))
+            if min_price is None and max_price is None and sort == 'id':
+                menu = Restaurant.get_menu(version)
+            else:
+                menu = Restaurant.get_filtered_menu(
+                    slug, min_price, max_price, sort)
+
+            return json_response(
+                {
+                    'Restaurant': menu
+                }
+            )
+
+        return conditional_response(
+            tuple(version), version.updated_at, build_response)
+
+    @app.route('/restaurants/<slug>/menu/stream')
+    @read_only
+    def stream_restaurant_menu(slug):
+        if not app.config['SSE_ENABLED']:
+            abort(503)
+
+        version = Restaurant.get_version(slug)
+        if version is None:
+            abort(404)
+
+        last_event_id = request.headers.get(
+            'Last-Event-ID', request.args.get('last_event_id'))
+        if last_event_id is not None:
+            try:
+                last_event_id = int(last_event_id)
+            except ValueError:
+                abort(400)
+
+        if not menu_events.open_stream():
+            abort(503)
+
+        # no stream_with_context: the generator needs neither the request
+        # nor the database, so the session is released before streaming
+        response = Response(
+            menu_events.stream(slug, version.revision, last_event_id),
+            mimetype='text/event-stream',
+            headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+        # also runs when the client leaves before the stream starts
+        response.call_on_close(menu_events.close_stream)
+        return response
 
     @app.route('/restaurants')
+    @read_only
     def get_restaurants():
-        return jsonify(
-            {'Restaurants': Restaurant.get_all_restaurants()}
-        )
+        slugs = get_list_arg('slugs')
+        ids = get_list_arg('ids', int)
+        if slugs is not None or ids is not None:
+            return get_restaurants_batch(slugs, ids)
+
+        limit, after = get_page_args()
+        fields = get_fields_arg(Restaurant)
+
+        def build_response():
+            restaurants, next_cursor = Restaurant.get_restaurants_page(
+                limit,
+                after=after,
+                city=request.args.get('city'),
+                state=request.args.get('state'),
+                fields=fields,
+                version=tuple(version)
+            )
+
+            return json_response(
+                {
+                    'Restaurants': restaurants,
+                    'next_cursor': next_cursor
+                }
+            )
+
+        version = Restaurant.get_catalog_version()
+        return conditional_response(version, version[-1], build_response)
+
+    def get_restaurants_batch(slugs, ids):
+        fields = get_fields_arg(Restaurant)
+        menus = request.args.get('include') == 'menu'
+        if (slugs is not None and ids is not None) or (menus and fields):
+            abort(400)
+
+        def build_response():
+            restaurants, missing = Restaurant.get_restaurants_by(
+                slugs, ids, fields=fields, menus=menus)
+
+            return json_response(
+                {
+                    'Restaurants': restaurants,
+                    'missing': missing
+                }
+            )
+
+        version = Restaurant.get_catalog_version()
+        return conditional_response(version, version[-1], build_response)
 
     @app.route('/items')
+    @read_only
     def get_items():
-        return jsonify(
-            {'Items': Item.get_all_items()}
+        limit = get_limit_arg()
+        min_price, max_price, sort = get_price_args()
+        if sort == 'price' and request.args.get('after') is not None:
+            try:
+                after = parse_price_cursor(request.args['after'])
+            except ValueError:
+                abort(400)
+        else:
+            after = get_int_arg('after')
+        restaurant_id = get_int_arg('restaurant_id')
+        fields = get_fields_arg(Item)
+        match = request.args.get('match', 'all')
+        if match not in ('all', 'any'):
+            abort(400)
+
+        def build_response():
+            items, next_cursor = Item.get_items_page(
+                limit,
+                after=after,
+                restaurant_id=restaurant_id,
+                section=request.args.get('section'),
+                categories=request.args.getlist('category'),
+                match_all=match == 'all',
+                min_price=min_price,
+                max_price=max_price,
+                sort=sort,
+                fields=fields,
+                version=tuple(version)
+            )
+
+            return json_response(
+                {
+                    'Items': items,
+                    'next_cursor': next_cursor
+                }
+            )
+
+        version = Restaurant.get_catalog_version()
+        return conditional_response(version, version[-1], build_response)
+
+    @app.route('/search')
+    @read_only
+    def search_menus():
+        q = request.args.get('q', '').strip()
+        if not q:
+            abort(400)
+
+        limit, offset = get_page_args()
+        results, next_offset = search.search(
+            q,
+            limit,
+            offset=offset or 0,
+            restaurant_id=get_int_arg('restaurant_id')
+        )
+
+        return json_response(
+            {
+                'Results': results,
+                'next_cursor': None if next_offset is None else str(next_offset)
+            }
         )
 
     @app.route('/restaurants', methods=['POST'])
@@ -221,6 +589,11 @@ def create_app(test_config=None):
         new_imageUrl = body.get('imageUrl', None)
         new_categories = body.get('categories', None)
 
+        try:
+            new_price = parse_price(new_price)
+        except ValueError:
+            abort(400)
+
         try:
             item = Item(
                 section=new_section,
@@ -242,6 +615,54 @@ def create_app(test_config=None):
             print(sys.exc_info)
             abort(422)
 
+    @app.route('/restaurants/<int:id>/items/bulk', methods=['POST'])
+    def add_items_bulk(id):
+        if Restaurant.query.get(id) is None:
+            abort(404)
+
+        rows = read_bulk_rows()
+
+        try:
+            created, errors = Item.bulk_add(
+                id, rows, app.config['BULK_INSERT_BATCH_SIZE'])
+        except Exception:
+            app.logger.exception('bulk import into restaurant %s failed', id)
+            abort(422)
+
+        success = created > 0 or not errors
+        return jsonify({
+            'success': success,
+            'created': created,
+            'errors': errors
+        }), 200 if success else 422
+
+    @app.route('/restaurants/<int:id>/items', methods=['PATCH'])
+    def update_items(id):
+        if Restaurant.query.get(id) is None:
+            abort(404)
+
+        rows = request.get_json()
+        if not isinstance(rows, list):
+            abort(400)
+
+        try:
+            updated, errors = Item.bulk_update(id, rows)
+        except Exception:
+            app.logger.exception('batch update of restaurant %s failed', id)
+            abort(422)
+
+        if errors:
+            return jsonify({
+                'success': False,
+                'updated': [],
+                'errors': errors
+            }), 422
+
+        return jsonify({
+            'success': True,
+            'updated': updated
+        }), 200
+
     @app.route('/restaurants/<int:id>', methods=['PATCH'])
     def update_restaurant(id):
         body = request.get_json()
@@ -264,16 +685,16 @@ def create_app(test_config=None):
             if restaurant is None:
                 abort(404)
             else:
-                restaurant.name = new_name,
-                restaurant.slug = new_slug,
-                restaurant.description = new_description,
-                restaurant.city = new_city,
-                restaurant.state = new_state,
-                restaurant.address = new_address,
-                restaurant.phone = new_phone,
-                restaurant.imageUrl = new_imageUrl,
-                restaurant.websiteUrl = new_websiteUrl,
-                restaurant.instagramUrl = new_instagramUrl,
+                restaurant.name = new_name
+                restaurant.slug = new_slug
+                restaurant.description = new_description
+                restaurant.city = new_city
+                restaurant.state = new_state
+                restaurant.address = new_address
+                restaurant.phone = new_phone
+                restaurant.imageUrl = new_imageUrl
+                restaurant.websiteUrl = new_websiteUrl
+                restaurant.instagramUrl = new_instagramUrl
                 restaurant.facebookUrl = new_facebookUrl
                 restaurant.update()
 
@@ -290,22 +711,18 @@ def create_app(test_config=None):
     def update_item(id):
         body = request.get_json()
 
-        new_section = body.get('section')
-        new_name = body.get('name')
-        new_shortDescription = body.get('shortDescription')
-        new_price = body.get('price')
-        new_imageUrl = body.get('imageUrl')
-        new_categories = body.get('categories')
+        try:
+            changes = validate_item(body, partial=True)
+        except ValueError:
+            abort(400)
+
+        item = Item.query.filter(Item.id == id).one_or_none()
+        if item is None:
+            abort(404)
 
         try:
-            item = Item(
-                section=new_section,
-                name=new_name,
-                shortDescription=new_shortDescription,
-                price=new_price,
-                imageUrl=new_imageUrl,
-                categories=new_categories
-            )
+            for field, value in changes.items():
+                setattr(item, field, value)
             item.update()
 
             return jsonify({
@@ -408,6 +825,14 @@ def create_app(test_config=None):
             'message': 'Internal server error'
         }), 500
 
+    @app.errorhandler(503)
+    def service_unavailable(error):
+        return jsonify({
+            'success': False,
+            'error': 503,
+            'message': 'Service Unavailable'
+        }), 503, {'Retry-After': '1'}
+
     return app
 
 
@@ -0,0 +1,369 @@
+'''Benchmark every route of the app against a seeded database.
+
+    python benchmark.py --restaurants 50 --items 100 --output bench.json
+    python benchmark.py --compare bench.json
+
+    python benchmark.py --serve sync --output sync.json
+    python benchmark.py --serve gthread --compare sync.json --threshold 1
+
+DATABASE_URL defaults to a throwaway SQLite file. Point it at a local
+Postgres to measure the real thing. The database is dropped and re-seeded.
+Results are written as JSON: p50/p95/p99 latency, throughput and SQL
+statements per request for each route. With --compare, routes whose p95
+grew by more than --threshold fail the run.
+
+--serve runs the GET routes over HTTP against gunicorn (app:app
+--preload, as in the Procfile) with the chosen worker class and
+--concurrency requests in flight, to compare serving modes. Use Postgres
+for meaningful numbers: SQLite serializes the workers' reads.
+'''
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import subprocess
+import warnings
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))
+    return ordered[index]
+
+
+class Recorder:
+    '''Counts SQL statements executed on the engine.'''
+
+    def __init__(self):
+        self.statements = 0
+
+    def before_cursor_execute(self, *args, **kwargs):
+        self.statements += 1
+
+
+def run_route(client, recorder, name, make_request, count):
+    latencies = []
+    statements = 0
+    errors = 0
+    started = time.perf_counter()
+
+    for n in range(count):
+        recorder.statements = 0
+        start = time.perf_counter()
+        response = make_request(n)
+        response.get_data()
+        latencies.append((time.perf_counter() - start) * 1000)
+        statements += recorder.statements
+
+        if response.status_code >= 400:
+            errors += 1
+
+    elapsed = time.perf_counter() - started
+    return {
+        'requests': count,
+        'errors': errors,
+        'p50_ms': round(percentile(latencies, 0.50), 3),
+        'p95_ms': round(percentile(latencies, 0.95), 3),
+        'p99_ms': round(percentile(latencies, 0.99), 3),
+        'throughput_rps': round(count / elapsed, 1),
+        'sql_per_request': round(statements / count, 2)
+    }
+
+
+def load_fixtures(models, count):
+    '''Rows the routes are pointed at. Write routes each get their own
+    rows so iterations don't collide; DELETE /restaurants/<id> gets count
+    empty restaurants.'''
+    slug = models.Restaurant.query.filter(
+        models.Restaurant.slug != 'padoca-veronese').first().slug
+    restaurant_id = models.Restaurant.query.filter_by(slug=slug).one().id
+    scratch = models.Restaurant.query.filter(
+        models.Restaurant.id != restaurant_id,
+        models.Restaurant.slug != 'padoca-veronese').first()
+    doomed = [models.Restaurant(name=f'Doomed {n}', slug=f'doomed-{n}')
+              for n in range(count)]
+    models.db.session.add_all(doomed)
+    models.db.session.commit()
+    return {
+        'doomed_ids': [restaurant.id for restaurant in doomed],
+        'slug': slug,
+        'restaurant_id': restaurant_id,
+        'item_ids': [item.id for item in models.Item.query.filter_by(
+            restaurant_id=restaurant_id)],
+        'scratch_slug': scratch.slug,
+        'scratch_item_ids': [item.id for item in models.Item.query.filter_by(
+            restaurant_id=scratch.id)]
+    }
+
+
+def read_paths(fixtures):
+    '''(name, path) of every GET route.'''
+    slug = fixtures['slug']
+    return [
+        ('GET /', '/'),
+        ('GET /api', '/api'),
+        ('GET /api?stream=1', '/api?stream=1'),
+        ('GET /restaurants', '/restaurants'),
+        ('GET /restaurants?city', '/restaurants?city=Floripa'),
+        ('GET /restaurants/<slug>', f'/restaurants/{slug}'),
+        ('GET /restaurants?slugs&include=menu',
+         f"/restaurants?slugs={slug},{fixtures['scratch_slug']}&include=menu"),
+        ('GET /restaurants/<slug>/menu', f'/restaurants/{slug}/menu'),
+        ('GET /restaurants/<slug>/menu?sort=price',
+         f'/restaurants/{slug}/menu?sort=price&max_price=50'),
+        ('GET /restaurants/<slug>/menu?since',
+         f'/restaurants/{slug}/menu?since=1'),
+        ('GET /items', '/items'),
+        ('GET /items?restaurant_id',
+         f"/items?restaurant_id={fixtures['restaurant_id']}"),
+        ('GET /items?sort=price', '/items?sort=price&min_price=20'),
+        ('GET /search', '/search?q=pao'),
+    ]
+
+
+def build_routes(client, fixtures):
+    '''(name, request function) pairs covering every route in
+    create_app, but the menu SSE stream, which never ends.'''
+    slug = fixtures['slug']
+    restaurant_id = fixtures['restaurant_id']
+    item_ids = fixtures['item_ids']
+    scratch_item_ids = fixtures['scratch_item_ids']
+    doomed_ids = fixtures['doomed_ids']
+
+    def get(path):
+        return lambda n: client.get(path)
+
+    login = {}
+
+    def logout(n):
+        # put back the login POST /login left in the session, so only the
+        # logout is timed
+        with client.session_transaction() as session:
+            if not login:
+                login.update((key, session[key])
+                             for key in ('_user_id', '_id', '_fresh'))
+            session.update(login)
+        return client.get('/logout')
+
+    item = {'section': 'Bebidas', 'name': 'Suco de caju', 'price': '9.90',
+            'categories': ['vegano']}
+
+    return [(name, get(path)) for name, path in read_paths(fixtures)] + [
+        ('POST /restaurants', lambda n: client.post('/restaurants', json={
+            'name': f'Bench {n}', 'slug': f'bench-{time.time_ns()}'})),
+        ('POST /restaurants/<id>/items', lambda n: client.post(
+            f'/restaurants/{restaurant_id}/items', json=item)),
+        ('POST /restaurants/<id>/items/bulk', lambda n: client.post(
+            f'/restaurants/{restaurant_id}/items/bulk', json=[item] * 20)),
+        ('PATCH /restaurants/<id>', lambda n: client.patch(
+            f'/restaurants/{restaurant_id}',
+            json={'name': f'Bench {n}', 'slug': slug})),
+        ('PATCH /restaurants/<id>/items', lambda n: client.patch(
+            f'/restaurants/{restaurant_id}/items', json=[
+                {'id': item_id, 'price': f'{10 + n}.90'}
+                for item_id in item_ids[:20]])),
+        ('PATCH /items/<id>', lambda n: client.patch(
+            f'/items/{item_ids[n % len(item_ids)]}', json=item)),
+        ('DELETE /items/<id>', lambda n: client.delete(
+            f'/items/{scratch_item_ids[n]}')),
+        ('DELETE /restaurants/<id>', lambda n: client.delete(
+            f'/restaurants/{doomed_ids[n]}')),
+        ('GET /metrics', get('/metrics')),
+        ('POST /login', lambda n: client.post('/login', data={
+            'email': 'bench@example.com', 'password': 'benchmark'})),
+        ('POST /register', lambda n: client.post('/register', data={
+            'username': f'bench{n}', 'email': f'bench{n}@example.com',
+            'password': 'benchmark', 'confirm_password': 'benchmark'})),
+        ('GET /logout', logout),
+    ]
+
+
+def start_server(worker_class, workers, port):
+    '''Run the app the way the Procfile does, with the given gunicorn
+    worker class (see gunicorn.conf.py), and wait until it answers.'''
+    env = dict(os.environ, GUNICORN_WORKER_CLASS=worker_class,
+               WEB_CONCURRENCY=str(workers), METRICS_ENABLED='false')
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', 'app:app', '--preload',
+         '--bind', f'127.0.0.1:{port}'],
+        cwd=os.path.dirname(os.path.abspath(__file__)), env=env,
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            urllib.request.urlopen(f'http://127.0.0.1:{port}/restaurants')
+            return process
+        except OSError:
+            if process.poll() is not None:
+                break
+            time.sleep(0.2)
+    process.kill()
+    raise RuntimeError(f'gunicorn ({worker_class}) did not start')
+
+
+def run_served_route(base_url, path, count, concurrency):
+    '''Like run_route, over HTTP with concurrency requests in flight.'''
+    def fetch(n):
+        start = time.perf_counter()
+        try:
+            with urllib.request.urlopen(base_url + path) as response:
+                response.read()
+            failed = False
+        except OSError:
+            failed = True
+        return (time.perf_counter() - start) * 1000, failed
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        outcomes = list(pool.map(fetch, range(count)))
+    elapsed = time.perf_counter() - started
+
+    latencies = [latency for latency, failed in outcomes]
+    return {
+        'requests': count,
+        'errors': sum(failed for latency, failed in outcomes),
+        'p50_ms': round(percentile(latencies, 0.50), 3),
+        'p95_ms': round(percentile(latencies, 0.95), 3),
+        'p99_ms': round(percentile(latencies, 0.99), 3),
+        'throughput_rps': round(count / elapsed, 1),
+        'sql_per_request': None
+    }
+
+
+def compare(results, baseline, threshold):
+    regressions = []
+    for name, current in results['routes'].items():
+        previous = baseline['routes'].get(name)
+        if previous and current['p95_ms'] > previous['p95_ms'] * threshold:
+            regressions.append(
+                f"{name}: p95 {previous['p95_ms']}ms -> {current['p95_ms']}ms")
+    return regressions
+
+
+def report(name, stats):
+    sql = stats['sql_per_request']
+    print(f"{name:45} p50 {stats['p50_ms']:8.2f}ms  "
+          f"p95 {stats['p95_ms']:8.2f}ms  p99 {stats['p99_ms']:8.2f}ms  "
+          f"{stats['throughput_rps']:8.1f} req/s  "
+          f"{'-' if sql is None else f'{sql:.1f}':>5} sql/req  "
+          f"{stats['errors']} errors")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--restaurants', type=int, default=20)
+    parser.add_argument('--items', type=int, default=100,
+                        help='items per restaurant')
+    parser.add_argument('--requests', type=int, default=50,
+                        help='requests per route')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--no-cache', action='store_true')
+    parser.add_argument('--output', default='bench.json')
+    parser.add_argument('--compare', help='baseline JSON to compare against')
+    parser.add_argument('--threshold', type=float, default=1.2,
+                        help='allowed p95 growth factor with --compare')
+    parser.add_argument('--serve', choices=['sync', 'gthread', 'gevent'],
+                        help='benchmark the GET routes over HTTP against '
+                             'gunicorn with this worker class')
+    parser.add_argument('--workers', type=int, default=2,
+                        help='gunicorn workers with --serve')
+    parser.add_argument('--concurrency', type=int, default=16,
+                        help='requests in flight with --serve')
+    parser.add_argument('--port', type=int, default=8765)
+    args = parser.parse_args()
+    if args.requests > args.items:
+        parser.error('--requests cannot exceed --items (DELETE needs rows)')
+
+    os.environ.setdefault('DATABASE_URL', 'sqlite:///benchmark.db')
+    warnings.simplefilter('ignore')
+
+    import app as app_module
+    import models
+    from sqlalchemy import event
+
+    app = app_module.app
+    app.config['WTF_CSRF_ENABLED'] = False
+    app.config['CACHE_ENABLED'] = not args.no_cache
+    models.cache.init_app(app)
+
+    with app.app_context():
+        models.db_drop_and_create_all(
+            args.restaurants, args.items, args.seed)
+        models.db.session.add(models.User(
+            username='bench', email='bench@example.com',
+            password=app_module.bcrypt.generate_password_hash('benchmark')))
+        models.db.session.commit()
+
+        client = app.test_client()
+        recorder = Recorder()
+        event.listen(models.db.engine, 'before_cursor_execute',
+                     recorder.before_cursor_execute)
+        fixtures = load_fixtures(models, args.requests)
+        routes = build_routes(client, fixtures)
+
+    results = {
+        'meta': {
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+            'commit': subprocess.run(
+                ['git', 'rev-parse', '--short', 'HEAD'],
+                capture_output=True, text=True).stdout.strip(),
+            'python': platform.python_version(),
+            'database': models.db.engine.url.get_backend_name(),
+            'restaurants': args.restaurants,
+            'items_per_restaurant': args.items,
+            'requests_per_route': args.requests,
+            'cache': not args.no_cache,
+            'server': args.serve and {
+                'worker_class': args.serve,
+                'workers': args.workers,
+                'concurrency': args.concurrency
+            }
+        },
+        'routes': {}
+    }
+
+    if args.serve:
+        # the workers load their own app from the same DATABASE_URL
+        server = start_server(args.serve, args.workers, args.port)
+        try:
+            for name, path in read_paths(fixtures):
+                results['routes'][name] = run_served_route(
+                    f'http://127.0.0.1:{args.port}', path, args.requests,
+                    args.concurrency)
+                report(name, results['routes'][name])
+        finally:
+            server.terminate()
+            server.wait()
+    else:
+        for name, make_request in routes:
+            results['routes'][name] = run_route(
+                client, recorder, name, make_request, args.requests)
+            report(name, results['routes'][name])
+
+    with open(args.output, 'w') as output:
+        json.dump(results, output, indent=2)
+
+    failed = [name for name, stats in results['routes'].items()
+              if stats['errors']]
+    for name in failed:
+        print('ERRORS', name)
+
+    regressions = []
+    if args.compare:
+        with open(args.compare) as baseline:
+            regressions = compare(results, json.load(baseline), args.threshold)
+        for regression in regressions:
+            print('REGRESSION', regression)
+
+    # error responses are timed too, so don't pass off their latency
+    if failed or regressions:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,191 @@
+import pickle
+import threading
+import time
+from collections import OrderedDict
+from flask import g, has_request_context
+
+
+class MemoryBackend:
+    '''Per-process LRU store with a time-to-live on every entry.'''
+
+    def __init__(self, max_entries, ttl):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.evictions = 0
+        # called with the key of every evicted entry
+        self.on_evict = None
+        self._entries = OrderedDict()
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return False, None
+
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return False, None
+
+            self._entries.move_to_end(key)
+            return True, value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                evicted, _ = self._entries.popitem(last=False)
+                self.evictions += 1
+                if self.on_evict is not None:
+                    self.on_evict(evicted)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def get_counter(self, key):
+        with self._lock:
+            return self._counters.get(key, 0)
+
+    def incr(self, key):
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._counters.clear()
+
+
+class RedisBackend:
+    '''Store shared by every gunicorn worker. Redis handles expiry and
+    eviction itself (configure maxmemory-policy allkeys-lru).'''
+
+    def __init__(self, url, ttl, prefix='menu-api:'):
+        import redis
+
+        self.ttl = ttl
+        self.prefix = prefix
+        self.on_evict = None
+        self._client = redis.Redis.from_url(url)
+
+    @property
+    def evictions(self):
+        '''Keys evicted by the Redis server, for every client.'''
+        return self._client.info('stats').get('evicted_keys', 0)
+
+    def get(self, key):
+        value = self._client.get(self.prefix + key)
+        if value is None:
+            return False, None
+        return True, pickle.loads(value)
+
+    def set(self, key, value):
+        self._client.setex(self.prefix + key, self.ttl, pickle.dumps(value))
+
+    def delete(self, key):
+        self._client.delete(self.prefix + key)
+
+    def get_counter(self, key):
+        return int(self._client.get(self.prefix + key) or 0)
+
+    def incr(self, key):
+        self._client.incr(self.prefix + key)
+
+    def clear(self):
+        for key in self._client.scan_iter(self.prefix + '*'):
+            self._client.delete(key)
+
+
+class Cache:
+    '''Read-through cache for serialized model data.
+
+    Entries live in namespaces. Most keys carry the version of the data
+    they hold, so writes never need to reach them. A whole namespace can
+    also be dropped with invalidate_namespace(), which bumps the namespace
+    generation so old keys are never read again and age out.
+    '''
+
+    def __init__(self, app=None):
+        self.enabled = False
+        self.backend = None
+        self.hits = 0
+        self.misses = 0
+        # called with (namespace, 'hit' | 'miss' | 'eviction'); see
+        # metrics.py
+        self.on_event = None
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.enabled = app.config.get('CACHE_ENABLED', True)
+        ttl = app.config.get('CACHE_TTL', 60)
+
+        if app.config.get('CACHE_BACKEND', 'memory') == 'redis':
+            self.backend = RedisBackend(app.config['CACHE_REDIS_URL'], ttl)
+        else:
+            self.backend = MemoryBackend(
+                app.config.get('CACHE_MAX_ENTRIES', 1024), ttl)
+        self.backend.on_evict = lambda key: self.count(
+            key.split(':', 1)[0], 'eviction')
+
+    def count(self, namespace, event):
+        if event != 'eviction':
+            with self._lock:
+                if event == 'hit':
+                    self.hits += 1
+                else:
+                    self.misses += 1
+        if self.on_event is not None:
+            self.on_event(namespace, event)
+
+    @property
+    def stats(self):
+        with self._lock:
+            stats = {'hits': self.hits, 'misses': self.misses}
+        stats['evictions'] = self.backend.evictions if self.backend else 0
+        return stats
+
+    def _key(self, namespace, key):
+        generation = self.backend.get_counter('generation:' + namespace)
+        return f'{namespace}:{generation}:{key!r}'
+
+    def get_or_set(self, namespace, key, loader, versioned=False):
+        '''Return the cached value, or call loader and cache its result.
+        None is never cached, so a missing row is looked up again.
+        Requests forcing primary reads skip the lookup and refresh it.
+
+        Unless the key carries the version of the data (versioned), a
+        value read from the replica is not cached: it may predate a write
+        whose invalidation has already run.'''
+        if not self.enabled:
+            return loader()
+
+        cache_key = self._key(namespace, key)
+        if not (has_request_context() and g.get('db_force_primary')):
+            found, value = self.backend.get(cache_key)
+            if found:
+                self.count(namespace, 'hit')
+                return value
+
+        self.count(namespace, 'miss')
+        value = loader()
+        if value is not None and (versioned or not (
+                has_request_context() and g.get('db_read_replica'))):
+            self.backend.set(cache_key, value)
+        return value
+
+    def invalidate_namespace(self, namespace):
+        if self.enabled:
+            self.backend.incr('generation:' + namespace)
+
+    def clear(self):
+        if self.enabled:
+            self.backend.clear()
+
+
+cache = Cache()
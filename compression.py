@@ -0,0 +1,72 @@
+import gzip
+from flask import request
+from cache import cache
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+ENCODINGS = ('br', 'gzip')
+
+
+def etag_variants(etag):
+    '''Every ETag a representation of this resource can carry: identity
+    plus one per content coding, so conditional requests match whichever
+    variant the client stored.'''
+    return [etag] + [f'{etag}-{encoding}' for encoding in ENCODINGS]
+
+
+def negotiate():
+    offered = ['gzip']
+    if brotli is not None:
+        offered.insert(0, 'br')
+    encoding = request.accept_encodings.best_match(offered)
+    return encoding if encoding in offered else None
+
+
+def compress(data, encoding, app):
+    if encoding == 'br':
+        return brotli.compress(data, quality=app.config['COMPRESS_BROTLI_QUALITY'])
+    return gzip.compress(data, compresslevel=app.config['COMPRESS_GZIP_LEVEL'])
+
+
+def init_compression(app):
+    '''Compress responses with brotli (when installed) or gzip, as
+    negotiated by Accept-Encoding. Bodies carrying an ETag are cacheable
+    menu/restaurant payloads: their compressed bytes are kept in the
+    cache under that ETag so repeat requests skip compression.'''
+    mimetypes = set(app.config['COMPRESS_MIMETYPES'])
+    min_size = app.config['COMPRESS_MIN_SIZE']
+
+    @app.after_request
+    def compress_response(response):
+        if response.mimetype not in mimetypes:
+            return response
+        response.vary.add('Accept-Encoding')
+
+        if (response.status_code != 200 or response.direct_passthrough or
+                response.is_streamed or 'Content-Encoding' in response.headers):
+            return response
+
+        data = response.get_data()
+        if len(data) < min_size:
+            return response
+
+        encoding = negotiate()
+        if encoding is None:
+            return response
+
+        etag, weak = response.get_etag()
+        if etag and not weak:
+            body = cache.get_or_set(
+                'compressed', (etag, encoding),
+                lambda: compress(data, encoding, app), versioned=True)
+            response.set_etag(f'{etag}-{encoding}')
+        else:
+            body = compress(data, encoding, app)
+
+        response.set_data(body)
+        response.headers['Content-Encoding'] = encoding
+        return response
@@ -5,3 +5,67 @@ class Config:
     basedir = os.path.abspath(os.path.dirname(__file__))
     DEBUG = True
     SECRET_KEY = os.urandom(32)
+    PAGE_SIZE = 100
+    MAX_PAGE_SIZE = 500
+    EXPORT_BATCH_SIZE = 500
+    MAX_BATCH_LOOKUP = 100
+    CACHE_ENABLED = True
+    CACHE_BACKEND = os.environ.get('CACHE_BACKEND', 'memory')
+    CACHE_REDIS_URL = os.environ.get('REDIS_URL')
+    CACHE_MAX_ENTRIES = int(os.environ.get('CACHE_MAX_ENTRIES', 1024))
+    CACHE_TTL = int(os.environ.get('CACHE_TTL', 60))
+    BULK_INSERT_BATCH_SIZE = 1000
+    # SEARCH_BACKEND is 'postgres' or 'sqlite', picked from the database
+    # URI when unset. The text config must match the search migration.
+    SEARCH_BACKEND = os.environ.get('SEARCH_BACKEND')
+    SEARCH_TEXT_CONFIG = 'portuguese'
+    METRICS_ENABLED = os.environ.get('METRICS_ENABLED', 'true') == 'true'
+    SLOW_REQUEST_MS = int(os.environ.get('SLOW_REQUEST_MS', 500))
+    DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 5))
+    DB_MAX_OVERFLOW = int(os.environ.get('DB_MAX_OVERFLOW', 5))
+    DB_POOL_TIMEOUT = int(os.environ.get('DB_POOL_TIMEOUT', 10))
+    DB_POOL_RECYCLE = int(os.environ.get('DB_POOL_RECYCLE', 1800))
+    DB_POOL_PRE_PING = os.environ.get('DB_POOL_PRE_PING', 'true') == 'true'
+    DB_PGBOUNCER = os.environ.get('DB_PGBOUNCER', 'false') == 'true'
+    DATABASE_REPLICA_URL = os.environ.get('DATABASE_REPLICA_URL')
+    DATABASE_REPLICA_MAX_LAG = float(
+        os.environ.get('DATABASE_REPLICA_MAX_LAG', 5))
+    DATABASE_REPLICA_CHECK_INTERVAL = float(
+        os.environ.get('DATABASE_REPLICA_CHECK_INTERVAL', 5))
+    # Responses smaller than COMPRESS_MIN_SIZE bytes are sent as they are;
+    # brotli is only offered when the brotli package is installed.
+    COMPRESS_ENABLED = os.environ.get('COMPRESS_ENABLED', 'true') == 'true'
+    COMPRESS_MIN_SIZE = int(os.environ.get('COMPRESS_MIN_SIZE', 500))
+    COMPRESS_MIMETYPES = ['application/json', 'text/html']
+    COMPRESS_GZIP_LEVEL = 6
+    COMPRESS_BROTLI_QUALITY = 5
+    # Admin list views show pg_class.reltuples instead of COUNT(*) for
+    # unfiltered tables estimated above this many rows
+    ADMIN_COUNT_ESTIMATE_THRESHOLD = int(
+        os.environ.get('ADMIN_COUNT_ESTIMATE_THRESHOLD', 100000))
+    # EVENTS_BACKEND is 'postgres' (LISTEN/NOTIFY) or 'memory' (single
+    # process), picked from the database URI when unset
+    EVENTS_BACKEND = os.environ.get('EVENTS_BACKEND')
+    # off under gunicorn's sync workers, see gunicorn.conf.py
+    SSE_ENABLED = os.environ.get('SSE_ENABLED', 'true') == 'true'
+    # open streams per process, beyond which the route answers 503; a
+    # client that goes away frees its slot at the next heartbeat
+    SSE_MAX_STREAMS = int(os.environ.get('SSE_MAX_STREAMS', 4))
+    SSE_HEARTBEAT = int(os.environ.get('SSE_HEARTBEAT', 15))
+    SSE_HISTORY = int(os.environ.get('SSE_HISTORY', 1000))
+    SSE_QUEUE_SIZE = int(os.environ.get('SSE_QUEUE_SIZE', 100))
+    # Password hashing runs in BCRYPT_WORKERS processes (0: inline); at
+    # most BCRYPT_MAX_PENDING hashes per web worker, then 503. Changing
+    # BCRYPT_LOG_ROUNDS rehashes passwords as users log in.
+    BCRYPT_LOG_ROUNDS = int(os.environ.get('BCRYPT_LOG_ROUNDS', 12))
+    BCRYPT_WORKERS = int(os.environ.get('BCRYPT_WORKERS', 2))
+    BCRYPT_MAX_PENDING = int(os.environ.get('BCRYPT_MAX_PENDING', 4))
+    BCRYPT_TIMEOUT = float(os.environ.get('BCRYPT_TIMEOUT', 5))
+    # Sessions last PERMANENT_SESSION_LIFETIME seconds from the last
+    # refresh, which happens once less than SESSION_REFRESH_REMAINING of
+    # it is left. Logged in users are cached USER_CACHE_TTL seconds.
+    PERMANENT_SESSION_LIFETIME = int(
+        os.environ.get('PERMANENT_SESSION_LIFETIME', 60))
+    SESSION_REFRESH_EACH_REQUEST = False
+    SESSION_REFRESH_REMAINING = 0.5
+    USER_CACHE_TTL = int(os.environ.get('USER_CACHE_TTL', 30))
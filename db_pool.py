@@ -0,0 +1,71 @@
+import time
+import threading
+from sqlalchemy.pool import NullPool, QueuePool
+
+
+class TimedQueuePool(QueuePool):
+    '''QueuePool that keeps track of how long checkouts wait for a free
+    connection. on_wait, when set, is called with each wait in seconds.'''
+
+    on_wait = None
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._stats_lock = threading.Lock()
+        self.waits = 0
+        self.wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+        self.failed_checkouts = 0
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        except Exception:
+            with self._stats_lock:
+                self.failed_checkouts += 1
+            raise
+        finally:
+            waited = time.perf_counter() - started
+            with self._stats_lock:
+                self.waits += 1
+                self.wait_seconds += waited
+                self.max_wait_seconds = max(self.max_wait_seconds, waited)
+            if TimedQueuePool.on_wait is not None:
+                TimedQueuePool.on_wait(waited)
+
+    def stats(self):
+        with self._stats_lock:
+            return {
+                'size': self.size(),
+                'checked_in': self.checkedin(),
+                'checked_out': self.checkedout(),
+                'overflow': max(self.overflow(), 0),
+                'waits': self.waits,
+                'wait_seconds': self.wait_seconds,
+                'max_wait_seconds': self.max_wait_seconds,
+                'failed_checkouts': self.failed_checkouts
+            }
+
+
+def engine_options(config, database_path):
+    '''SQLALCHEMY_ENGINE_OPTIONS for the configured pool mode.
+
+    DB_PGBOUNCER switches to NullPool for PgBouncer transaction pooling:
+    PgBouncer owns the pool, so connections are opened per checkout and
+    never kept. psycopg2 doesn't use server-side prepared statements, so
+    nothing else needs turning off.'''
+    if database_path.startswith('sqlite'):
+        return {}
+
+    if config['DB_PGBOUNCER']:
+        return {'poolclass': NullPool}
+
+    return {
+        'poolclass': TimedQueuePool,
+        'pool_size': config['DB_POOL_SIZE'],
+        'max_overflow': config['DB_MAX_OVERFLOW'],
+        'pool_timeout': config['DB_POOL_TIMEOUT'],
+        'pool_recycle': config['DB_POOL_RECYCLE'],
+        'pool_pre_ping': config['DB_POOL_PRE_PING']
+    }
@@ -0,0 +1,277 @@
+import json
+import time
+import queue
+import select
+import logging
+import threading
+from collections import deque
+from sqlalchemy import event, func
+from sqlalchemy import select as sql_select
+from models import db
+from serializers import dumps
+
+
+CHANNEL = 'menu_changes'
+# NOTIFY payloads must stay under 8000 bytes
+MAX_NOTIFY_BYTES = 7900
+
+logger = logging.getLogger('menu_api.events')
+
+
+class Subscription:
+
+    def __init__(self, slug, max_queued):
+        self.slug = slug
+        self.queue = queue.Queue(maxsize=max_queued)
+        self.overflowed = False
+
+
+class Broker:
+    '''In-process fan-out of menu events to the open streams, plus a
+    ring buffer of recent events so reconnecting clients can resume.'''
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.subscriptions = {}
+        self.history = deque(maxlen=1000)
+        self.max_queued = 100
+
+    def configure(self, history, max_queued):
+        with self.lock:
+            self.history = deque(self.history, maxlen=history)
+            self.max_queued = max_queued
+
+    def subscribe(self, slug):
+        '''Register a stream and return it with the buffered events of
+        its restaurant, taken atomically so nothing falls in between.'''
+        with self.lock:
+            subscription = Subscription(slug, self.max_queued)
+            self.subscriptions.setdefault(slug, set()).add(subscription)
+            history = [e for e in self.history if e['slug'] == slug]
+        return subscription, history
+
+    def unsubscribe(self, subscription):
+        with self.lock:
+            subscriptions = self.subscriptions.get(subscription.slug, set())
+            subscriptions.discard(subscription)
+            if not subscriptions:
+                self.subscriptions.pop(subscription.slug, None)
+
+    def publish(self, menu_event):
+        with self.lock:
+            self.history.append(menu_event)
+            subscriptions = list(
+                self.subscriptions.get(menu_event['slug'], ()))
+
+        for subscription in subscriptions:
+            try:
+                subscription.queue.put_nowait(menu_event)
+            except queue.Full:
+                # a client that can't keep up is dropped; it reconnects
+                # with Last-Event-ID and resumes from the history
+                subscription.overflowed = True
+                self.unsubscribe(subscription)
+
+
+class MemoryTransport:
+    '''Delivers events to the streams of this process only, once the
+    transaction commits. Enough for tests and a single process.'''
+
+    def __init__(self, broker):
+        self.broker = broker
+
+    def send(self, session, events):
+        session.info.setdefault('menu_events_committed', []).extend(events)
+
+    def committed(self, session):
+        for menu_event in session.info.pop('menu_events_committed', ()):
+            self.broker.publish(menu_event)
+
+    def start(self):
+        pass
+
+
+class PostgresTransport:
+    '''Sends events with pg_notify inside the writing transaction, so
+    they are delivered only if it commits, and to every process. Each
+    process LISTENs on one dedicated connection from a background
+    thread, started with the first stream. LISTEN needs a session-level
+    connection: point DATABASE_URL past PgBouncer transaction pooling.'''
+
+    def __init__(self, broker, app):
+        self.broker = broker
+        self.app = app
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def send(self, session, events):
+        connection = session.connection()
+        for menu_event in events:
+            payload = dumps(menu_event)
+            if len(payload) > MAX_NOTIFY_BYTES:
+                payload = dumps(dict(menu_event, changes=None))
+            connection.execute(sql_select(
+                func.pg_notify(CHANNEL, payload.decode('utf-8'))))
+
+    def committed(self, session):
+        pass
+
+    def start(self):
+        with self.lock:
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(
+                    target=self.listen, name='menu-events', daemon=True)
+                self.thread.start()
+
+    def listen(self):
+        while True:
+            connection = None
+            try:
+                connection = db.get_engine(self.app).raw_connection()
+                connection.detach()
+                dbapi_connection = connection.connection
+                dbapi_connection.autocommit = True
+                dbapi_connection.cursor().execute(f'LISTEN {CHANNEL}')
+
+                while True:
+                    if select.select([dbapi_connection], [], [], 5) == \
+                            ([], [], []):
+                        continue
+                    dbapi_connection.poll()
+                    while dbapi_connection.notifies:
+                        notify = dbapi_connection.notifies.pop(0)
+                        self.broker.publish(json.loads(notify.payload))
+            except Exception:
+                logger.warning('menu event listener failed, reconnecting',
+                               exc_info=True)
+                time.sleep(1)
+            finally:
+                if connection is not None:
+                    connection.close()
+
+
+def format_event(name, event_id, data):
+    return f'id: {event_id}\nevent: {name}\ndata: {dumps(data).decode()}\n\n'
+
+
+class MenuEvents:
+    '''Publishes the menu change events queued by the model write paths
+    (see bump_revisions and collect_menu_changes in models.py) and
+    serves them as Server-Sent Events.
+
+    Event ids are restaurant revisions. Every bump is one event, so a
+    client resuming from Last-Event-ID n needs events n+1, n+2, ... from
+    the history; when they are not all there it gets a reset event and
+    should reload the menu.
+
+    Each open stream holds a thread (or greenlet) of the worker, so at
+    most SSE_MAX_STREAMS are open per process; see open_stream().'''
+
+    def __init__(self, app=None):
+        self.broker = Broker()
+        self.transport = None
+        self.heartbeat = 15
+        self.streams = threading.BoundedSemaphore(4)
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        name = app.config.get('EVENTS_BACKEND')
+        if name is None:
+            uri = app.config['SQLALCHEMY_DATABASE_URI']
+            name = 'postgres' if uri.startswith('postgresql') else 'memory'
+
+        if name == 'postgres':
+            self.transport = PostgresTransport(self.broker, app)
+        else:
+            self.transport = MemoryTransport(self.broker)
+
+        self.heartbeat = app.config.get('SSE_HEARTBEAT', 15)
+        self.streams = threading.BoundedSemaphore(
+            app.config.get('SSE_MAX_STREAMS', 4))
+        self.broker.configure(app.config.get('SSE_HISTORY', 1000),
+                              app.config.get('SSE_QUEUE_SIZE', 100))
+
+        if not event.contains(db.session, 'after_flush', self.send_pending):
+            event.listen(db.session, 'after_flush', self.send_pending)
+            event.listen(db.session, 'before_commit', self.send_pending)
+            event.listen(db.session, 'after_commit', self.committed)
+            event.listen(db.session, 'after_rollback', self.discard)
+
+    def send_pending(self, session, flush_context=None):
+        '''Flushes send the events their before_flush bumps queued; bulk
+        writes that bypass the flush are sent before commit.'''
+        pending = session.info.pop('menu_events', None)
+        if pending:
+            self.transport.send(session, [
+                menu_event for menu_event in pending.values()
+                if menu_event['slug'] is not None
+            ])
+
+    def committed(self, session):
+        self.transport.committed(session)
+
+    def discard(self, session):
+        session.info.pop('menu_events_committed', None)
+
+    def open_stream(self):
+        '''Take a stream slot, or return False when all are in use. Give
+        it back with close_stream once the response is closed.'''
+        return self.streams.acquire(blocking=False)
+
+    def close_stream(self):
+        self.streams.release()
+
+    def stream(self, slug, revision, last_event_id=None):
+        '''Generator of SSE messages for one restaurant. revision is the
+        current one; without last_event_id the client is assumed to hold
+        it. Sends a comment every heartbeat seconds while idle.'''
+        self.transport.start()
+        subscription, history = self.broker.subscribe(slug)
+        try:
+            last = revision if last_event_id is None else last_event_id
+
+            missed = sorted((e for e in history if e['revision'] > last),
+                            key=lambda e: e['revision'])
+            contiguous = [e['revision'] for e in missed] == list(
+                range(last + 1, last + 1 + len(missed)))
+
+            yield 'retry: 3000\n\n'
+            if contiguous and last + len(missed) >= revision:
+                for menu_event in missed:
+                    yield self.format(menu_event)
+                    last = menu_event['revision']
+            else:
+                last = max([revision] + [e['revision'] for e in missed])
+                yield format_event('reset', last,
+                                   {'slug': slug, 'revision': last})
+
+            while True:
+                if subscription.overflowed and subscription.queue.empty():
+                    return
+                try:
+                    menu_event = subscription.queue.get(timeout=self.heartbeat)
+                except queue.Empty:
+                    yield ': heartbeat\n\n'
+                    continue
+
+                if menu_event['revision'] <= last:
+                    continue
+                if menu_event['revision'] > last + 1:
+                    # something was missed in between
+                    menu_event = dict(menu_event, changes=None)
+                yield self.format(menu_event)
+                last = menu_event['revision']
+        finally:
+            self.broker.unsubscribe(subscription)
+
+    def format(self, menu_event):
+        data = {'slug': menu_event['slug'],
+                'revision': menu_event['revision'],
+                'changes': menu_event['changes']}
+        if menu_event['changes'] is None:
+            return format_event('reset', menu_event['revision'], data)
+        return format_event('menu', menu_event['revision'], data)
+
+
+menu_events = MenuEvents()
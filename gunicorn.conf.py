@@ -0,0 +1,78 @@
+import os
+import sys
+import shutil
+import multiprocessing
+
+
+# Worker model, picked with GUNICORN_WORKER_CLASS:
+#
+#   gthread  GUNICORN_THREADS requests per worker, on threads (the
+#            default). No extra dependencies; suits the I/O bound read
+#            routes. Every open menu SSE stream holds one thread, so
+#            at most SSE_MAX_STREAMS (half the threads) are allowed.
+#   gevent   GUNICORN_WORKER_CONNECTIONS requests per worker, on
+#            greenlets. Needs `pip install gevent psycogreen`. Best for
+#            many slow clients such as the menu SSE streams.
+#   sync     one request per worker (gunicorn's own default). Each worker
+#            sits idle for the whole Postgres round trip, so concurrency
+#            costs a process and a connection per request in flight. A
+#            sync worker can't heartbeat while streaming and is killed
+#            after `timeout`, so the SSE route answers 503 here.
+#
+# Sizing: start with WEB_CONCURRENCY = CPU cores (sync keeps gunicorn's
+# default of WEB_CONCURRENCY or 1; 2 x cores + 1 is the usual figure).
+# Every request in flight may hold a database connection, so each worker
+# gets DB_POOL_SIZE = threads (gthread) or a pool the size of its
+# expected concurrent queries (gevent, default 10 with DB_MAX_OVERFLOW
+# absorbing bursts; waits show up in menu_api_db_pool_wait_seconds).
+# Keep WEB_CONCURRENCY x (DB_POOL_SIZE + DB_MAX_OVERFLOW) below Postgres
+# max_connections, or put PgBouncer in front (DB_PGBOUNCER=true).
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gthread')
+os.environ.setdefault('SSE_ENABLED', str(worker_class != 'sync').lower())
+cores = multiprocessing.cpu_count()
+
+if worker_class == 'gthread':
+    workers = int(os.environ.get('WEB_CONCURRENCY', cores))
+    threads = int(os.environ.get('GUNICORN_THREADS', 8))
+    os.environ.setdefault('DB_POOL_SIZE', str(threads))
+    # leave at least half the threads to the other routes
+    os.environ.setdefault('SSE_MAX_STREAMS', str(max(1, threads // 2)))
+elif worker_class == 'gevent':
+    workers = int(os.environ.get('WEB_CONCURRENCY', cores))
+    worker_connections = int(
+        os.environ.get('GUNICORN_WORKER_CONNECTIONS', 100))
+    os.environ.setdefault('DB_POOL_SIZE', '10')
+    os.environ.setdefault('SSE_MAX_STREAMS', str(worker_connections // 2))
+
+    # The app is loaded with --preload, before gunicorn's gevent worker
+    # would patch the standard library, so patch here, ahead of every
+    # import. psycopg2 is C code: psycogreen makes it yield to the gevent
+    # loop while waiting on Postgres instead of blocking the worker.
+    from gevent import monkey
+    monkey.patch_all()
+    from psycogreen.gevent import patch_psycopg
+    patch_psycopg()
+
+
+# Metrics are collected per worker in PROMETHEUS_MULTIPROC_DIR and summed
+# by /metrics (see metrics.py). Start from an empty directory and drop the
+# files of workers that exit so their gauges don't linger.
+def on_starting(server):
+    directory = os.environ.get('PROMETHEUS_MULTIPROC_DIR')
+    if directory:
+        shutil.rmtree(directory, ignore_errors=True)
+        os.makedirs(directory)
+
+
+def child_exit(server, worker):
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(worker.pid)
+
+
+# The Procfile runs with --preload, so the app and its SQLAlchemy engine
+# are created in the master. Give every worker its own connection pool.
+def post_fork(server, worker):
+    models = sys.modules.get('models')
+    if models is not None:
+        models.dispose_engines()
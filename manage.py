@@ -2,7 +2,8 @@ from flask_script import Manager
 from flask_migrate import Migrate, MigrateCommand
 
 from app import app
-from models import db
+from models import db, db_drop_and_create_all, rebuild_all_menu_documents
+from snapshots import export_snapshots, watch_snapshots
 
 migrate = Migrate(app, db)
 manager = Manager(app)
@@ -10,5 +11,32 @@ manager = Manager(app)
 manager.add_command('db', MigrateCommand)
 
 
+@manager.option('-r', '--restaurants', dest='restaurants', type=int, default=10)
+@manager.option('-i', '--items', dest='items', type=int, default=50)
+@manager.option('-s', '--seed', dest='seed', type=int, default=0)
+def seed(restaurants, items, seed):
+    '''Drop every table and fill the database with synthetic menus'''
+    db_drop_and_create_all(restaurants, items, seed)
+
+
+@manager.option('-b', '--batch-size', dest='batch_size', type=int, default=100)
+def rebuild_menus(batch_size):
+    '''Rebuild every restaurant's stored menu document'''
+    print(f'{rebuild_all_menu_documents(batch_size)} menus rebuilt')
+
+
+@manager.option('-d', '--directory', dest='directory', default='snapshots')
+@manager.option('-c', '--compress', dest='compress', action='store_true')
+@manager.option('-w', '--watch', dest='watch', action='store_true')
+@manager.option('-n', '--interval', dest='interval', type=float, default=5)
+def snapshot(directory, compress, watch, interval):
+    '''Write static menu JSON per restaurant, plus .gz/.br with --compress'''
+    if watch:
+        watch_snapshots(app, directory, compress, interval)
+    else:
+        written, removed = export_snapshots(app, directory, compress)
+        print(f'{written} menus written, {removed} removed')
+
+
 if __name__ == '__main__':
     manager.run()
@@ -0,0 +1,152 @@
+import os
+import json
+import time
+import logging
+from flask import Response, g, request, has_request_context
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from prometheus_client import (CollectorRegistry, Counter, Gauge, Histogram,
+                               REGISTRY, CONTENT_TYPE_LATEST, generate_latest,
+                               multiprocess)
+from models import db, user_cache
+from cache import cache, RedisBackend
+from db_pool import TimedQueuePool
+
+
+# With gunicorn, set PROMETHEUS_MULTIPROC_DIR so every worker writes its
+# samples there and /metrics reports the sum over all workers (see
+# gunicorn.conf.py, which wipes the directory and reaps dead workers).
+REQUEST_SECONDS = Histogram(
+    'menu_api_request_seconds', 'Request latency',
+    ['endpoint', 'method', 'status'])
+REQUEST_SQL_STATEMENTS = Histogram(
+    'menu_api_request_sql_statements', 'SQL statements executed per request',
+    ['endpoint'], buckets=(0, 1, 2, 3, 5, 10, 20, 50, 100, float('inf')))
+REQUEST_SQL_SECONDS = Histogram(
+    'menu_api_request_sql_seconds', 'Time spent in the database per request',
+    ['endpoint'])
+SLOW_REQUESTS = Counter(
+    'menu_api_slow_requests', 'Requests slower than SLOW_REQUEST_MS',
+    ['endpoint'])
+POOL_SIZE = Gauge(
+    'menu_api_db_pool_size', 'Connections kept in the pool',
+    multiprocess_mode='livesum')
+POOL_CHECKED_OUT = Gauge(
+    'menu_api_db_pool_checked_out', 'Connections currently checked out',
+    multiprocess_mode='livesum')
+POOL_OVERFLOW = Gauge(
+    'menu_api_db_pool_overflow', 'Connections open beyond pool_size',
+    multiprocess_mode='livesum')
+POOL_WAIT_SECONDS = Histogram(
+    'menu_api_db_pool_wait_seconds', 'Time spent waiting for a connection',
+    buckets=(.001, .005, .01, .05, .1, .5, 1, 5, 10, float('inf')))
+CACHE_EVENTS = Counter(
+    'menu_api_cache_events', 'Cache hits, misses and evictions',
+    ['namespace', 'event'])
+CACHE_REDIS_EVICTIONS = Gauge(
+    'menu_api_cache_redis_evicted_keys',
+    'Keys evicted by the Redis cache server', multiprocess_mode='max')
+USER_LOADS = Counter(
+    'menu_api_user_loads', 'Logged in users loaded, from the user cache or '
+    'the database', ['source'])
+
+MAX_LOGGED_STATEMENTS = 50
+
+slow_request_log = logging.getLogger('menu_api.slow_requests')
+
+
+def before_cursor_execute(conn, cursor, statement, parameters, context,
+                          executemany):
+    if has_request_context() and 'sql_seconds' in g:
+        g.sql_started = time.perf_counter()
+
+
+def after_cursor_execute(conn, cursor, statement, parameters, context,
+                         executemany):
+    if not has_request_context() or 'sql_started' not in g:
+        return
+
+    duration = time.perf_counter() - g.pop('sql_started')
+    g.sql_count += 1
+    g.sql_seconds += duration
+    if len(g.sql_statements) < MAX_LOGGED_STATEMENTS:
+        g.sql_statements.append(
+            {'sql': statement, 'ms': round(duration * 1000, 3)})
+
+
+def sample_pool():
+    pool = db.engine.pool
+    if isinstance(pool, TimedQueuePool):
+        stats = pool.stats()
+        POOL_SIZE.set(stats['size'])
+        POOL_CHECKED_OUT.set(stats['checked_out'])
+        POOL_OVERFLOW.set(stats['overflow'])
+
+
+def metrics_view():
+    # the memory backend reports its evictions as they happen
+    if isinstance(cache.backend, RedisBackend):
+        CACHE_REDIS_EVICTIONS.set(cache.backend.evictions)
+
+    if 'PROMETHEUS_MULTIPROC_DIR' in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+
+    return Response(generate_latest(registry), mimetype=CONTENT_TYPE_LATEST)
+
+
+def init_metrics(app):
+    '''Record per-endpoint latency and SQL statistics and serve them at
+    /metrics. Requests slower than SLOW_REQUEST_MS are logged as one JSON
+    line with their statements.'''
+    slow_request_ms = app.config.get('SLOW_REQUEST_MS', 500)
+
+    if not event.contains(Engine, 'before_cursor_execute',
+                          before_cursor_execute):
+        event.listen(Engine, 'before_cursor_execute', before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', after_cursor_execute)
+    TimedQueuePool.on_wait = POOL_WAIT_SECONDS.observe
+    cache.on_event = lambda namespace, name: CACHE_EVENTS.labels(
+        namespace, name).inc()
+    user_cache.on_load = lambda source: USER_LOADS.labels(source).inc()
+
+    @app.before_request
+    def start_request_metrics():
+        g.request_started = time.perf_counter()
+        g.sql_count = 0
+        g.sql_seconds = 0.0
+        g.sql_statements = []
+
+    @app.after_request
+    def record_request_metrics(response):
+        if 'request_started' not in g:
+            return response
+
+        duration = time.perf_counter() - g.request_started
+        endpoint = request.endpoint or 'unmatched'
+
+        REQUEST_SECONDS.labels(
+            endpoint, request.method, response.status_code).observe(duration)
+        REQUEST_SQL_STATEMENTS.labels(endpoint).observe(g.sql_count)
+        REQUEST_SQL_SECONDS.labels(endpoint).observe(g.sql_seconds)
+        sample_pool()
+
+        if duration * 1000 >= slow_request_ms:
+            SLOW_REQUESTS.labels(endpoint).inc()
+            slow_request_log.warning(json.dumps({
+                'event': 'slow_request',
+                'method': request.method,
+                'path': request.full_path,
+                'endpoint': endpoint,
+                'status': response.status_code,
+                'duration_ms': round(duration * 1000, 3),
+                'sql_count': g.sql_count,
+                'sql_ms': round(g.sql_seconds * 1000, 3),
+                'statements': g.sql_statements
+            }))
+
+        return response
+
+    app.add_url_rule('/metrics', 'metrics', metrics_view)
@@ -0,0 +1,32 @@
+"""add menu indexes
+
+Revision ID: 5b7e93a0c4d2
+Revises: 8c2d1f4e7a90
+Create Date: 2026-10-18 10:03:17.582930
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5b7e93a0c4d2'
+down_revision = '8c2d1f4e7a90'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index(op.f('ix_items_restaurant_id'), 'items', ['restaurant_id'], unique=False)
+    op.create_index(op.f('ix_items_section'), 'items', ['section'], unique=False)
+    op.create_index('ix_items_categories', 'items', ['categories'], unique=False, postgresql_using='gin')
+    op.create_index(op.f('ix_restaurants_city'), 'restaurants', ['city'], unique=False)
+    op.create_index(op.f('ix_restaurants_state'), 'restaurants', ['state'], unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_restaurants_state'), table_name='restaurants')
+    op.drop_index(op.f('ix_restaurants_city'), table_name='restaurants')
+    op.drop_index('ix_items_categories', table_name='items')
+    op.drop_index(op.f('ix_items_section'), table_name='items')
+    op.drop_index(op.f('ix_items_restaurant_id'), table_name='items')
@@ -0,0 +1,28 @@
+"""add restaurant revision
+
+Revision ID: 8c2d1f4e7a90
+Revises: 3af4086b9701
+Create Date: 2026-10-18 09:12:41.204513
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8c2d1f4e7a90'
+down_revision = '3af4086b9701'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('restaurants', sa.Column(
+        'revision', sa.Integer(), server_default='1', nullable=False))
+    op.add_column('restaurants', sa.Column(
+        'updated_at', sa.DateTime(), server_default=sa.text('now()'), nullable=False))
+
+
+def downgrade():
+    op.drop_column('restaurants', 'updated_at')
+    op.drop_column('restaurants', 'revision')
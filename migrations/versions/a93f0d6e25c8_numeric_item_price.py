@@ -0,0 +1,90 @@
+"""numeric item price
+
+Revision ID: a93f0d6e25c8
+Revises: e41a6c2b9f17
+Create Date: 2026-10-18 13:40:08.771245
+
+"""
+import re
+from decimal import Decimal
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a93f0d6e25c8'
+down_revision = 'e41a6c2b9f17'
+branch_labels = None
+depends_on = None
+
+
+# same rules as models.parse_price at the time of this migration
+PRICE_PATTERN = re.compile(r'^\d{1,8}(\.\d{1,2})?$')
+GROUPED_PRICE_PATTERN = re.compile(
+    r'^\d{1,3}(?P<sep>[.,])\d{3}(?:(?P=sep)\d{3})*(?:(?!(?P=sep))[.,]\d{1,2})?$')
+
+
+def parse_price(value):
+    '''"69,90", "R$ 69.90", "R$ 1.234,56" -> Decimal, blank -> None,
+    anything else -> ValueError.'''
+    text = value.replace('R$', '').strip()
+    if not text:
+        return None
+    grouped = GROUPED_PRICE_PATTERN.match(text)
+    if grouped:
+        text = text.replace(grouped.group('sep'), '')
+    text = text.replace(',', '.')
+    if not PRICE_PATTERN.match(text):
+        raise ValueError(value)
+    return Decimal(text).quantize(Decimal('0.01'))
+
+
+def upgrade():
+    items = sa.table('items',
+                     sa.column('id', sa.Integer),
+                     sa.column('price', sa.String),
+                     sa.column('price_numeric', sa.Numeric(10, 2)))
+    connection = op.get_bind()
+
+    # parse everything before touching the table: a price that doesn't
+    # parse stops the upgrade instead of silently becoming NULL
+    prices = []
+    invalid = []
+    for item_id, price in connection.execute(
+            sa.select(items.c.id, items.c.price)
+            .where(items.c.price.isnot(None))):
+        try:
+            value = parse_price(price)
+        except ValueError:
+            invalid.append((item_id, price))
+            continue
+        if value is not None:
+            prices.append({'item_id': item_id, 'value': value})
+
+    if invalid:
+        listed = ', '.join(f'{item_id}: {price!r}'
+                           for item_id, price in invalid[:20])
+        raise RuntimeError(
+            f'{len(invalid)} item prices do not parse; fix them and run '
+            f'the upgrade again. Items (first 20): {listed}')
+
+    op.add_column('items', sa.Column('price_numeric', sa.Numeric(10, 2), nullable=True))
+    if prices:
+        connection.execute(
+            items.update()
+            .where(items.c.id == sa.bindparam('item_id'))
+            .values(price_numeric=sa.bindparam('value')),
+            prices)
+    op.drop_column('items', 'price')
+    op.alter_column('items', 'price_numeric', new_column_name='price')
+    op.create_index('ix_items_price_id', 'items', ['price', 'id'], unique=False)
+    op.create_index('ix_items_restaurant_id_price', 'items', ['restaurant_id', 'price'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_items_restaurant_id_price', table_name='items')
+    op.drop_index('ix_items_price_id', table_name='items')
+    op.alter_column('items', 'price',
+                    existing_type=sa.Numeric(10, 2),
+                    type_=sa.String(),
+                    postgresql_using='price::text')
@@ -0,0 +1,31 @@
+"""add catalog revision
+
+Revision ID: b6e2f09d4c17
+Revises: f3a81c5d2e64
+Create Date: 2026-10-18 16:20:41.118204
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b6e2f09d4c17'
+down_revision = 'f3a81c5d2e64'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('catalog',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('revision', sa.Integer(), nullable=False),
+    sa.Column('updated_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.execute(
+        "INSERT INTO catalog (id, revision, updated_at) VALUES (1, 1, now())")
+
+
+def downgrade():
+    op.drop_table('catalog')
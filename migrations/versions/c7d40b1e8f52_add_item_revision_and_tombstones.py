@@ -0,0 +1,42 @@
+"""add item revision and tombstones
+
+Revision ID: c7d40b1e8f52
+Revises: a93f0d6e25c8
+Create Date: 2026-10-18 15:02:41.318406
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c7d40b1e8f52'
+down_revision = 'a93f0d6e25c8'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # existing items count as revision 1: every menu already downloaded
+    # holds them, and a sync from revision 0 still returns them
+    op.add_column('items', sa.Column('revision', sa.Integer(), server_default='1', nullable=False))
+    op.add_column('items', sa.Column('updated_at', sa.DateTime(), server_default=sa.text('now()'), nullable=False))
+    op.create_index('ix_items_restaurant_id_revision', 'items', ['restaurant_id', 'revision'], unique=False)
+    op.create_table('tombstones',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('table_name', sa.String(length=50), nullable=False),
+    sa.Column('row_id', sa.Integer(), nullable=False),
+    sa.Column('restaurant_id', sa.Integer(), nullable=False),
+    sa.Column('revision', sa.Integer(), nullable=False),
+    sa.Column('deleted_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_tombstones_restaurant_id_revision', 'tombstones', ['restaurant_id', 'revision'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_tombstones_restaurant_id_revision', table_name='tombstones')
+    op.drop_table('tombstones')
+    op.drop_index('ix_items_restaurant_id_revision', table_name='items')
+    op.drop_column('items', 'updated_at')
+    op.drop_column('items', 'revision')
@@ -0,0 +1,45 @@
+"""add full text search
+
+Revision ID: e41a6c2b9f17
+Revises: 5b7e93a0c4d2
+Create Date: 2026-10-18 11:26:54.319402
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e41a6c2b9f17'
+down_revision = '5b7e93a0c4d2'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # generated columns need Postgres 12+; Config.SEARCH_TEXT_CONFIG must
+    # name the same text search configuration
+    op.execute('''
+        ALTER TABLE items ADD COLUMN search_vector tsvector
+        GENERATED ALWAYS AS (
+            setweight(to_tsvector('portuguese', coalesce(name, '')), 'A') ||
+            setweight(to_tsvector('portuguese', coalesce(section, '')), 'B') ||
+            setweight(to_tsvector('portuguese', coalesce("shortDescription", '')), 'C')
+        ) STORED
+    ''')
+    op.execute('''
+        ALTER TABLE restaurants ADD COLUMN search_vector tsvector
+        GENERATED ALWAYS AS (
+            setweight(to_tsvector('portuguese', coalesce(name, '')), 'A') ||
+            setweight(to_tsvector('portuguese', coalesce(description, '')), 'B')
+        ) STORED
+    ''')
+    op.create_index('ix_items_search_vector', 'items', ['search_vector'], unique=False, postgresql_using='gin')
+    op.create_index('ix_restaurants_search_vector', 'restaurants', ['search_vector'], unique=False, postgresql_using='gin')
+
+
+def downgrade():
+    op.drop_index('ix_restaurants_search_vector', table_name='restaurants')
+    op.drop_index('ix_items_search_vector', table_name='items')
+    op.drop_column('restaurants', 'search_vector')
+    op.drop_column('items', 'search_vector')
@@ -0,0 +1,27 @@
+"""add restaurant menu document
+
+Revision ID: f3a81c5d2e64
+Revises: c7d40b1e8f52
+Create Date: 2026-10-18 15:47:19.562093
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = 'f3a81c5d2e64'
+down_revision = 'c7d40b1e8f52'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # filled by "python manage.py rebuild_menus"; until then menus are
+    # built from the items on read
+    op.add_column('restaurants', sa.Column('menu_document', postgresql.JSONB(astext_type=sa.Text()), nullable=True))
+
+
+def downgrade():
+    op.drop_column('restaurants', 'menu_document')
@@ -1,28 +1,65 @@
 import os
+import re
 import json
+import random
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
 from flask import Flask
-from sqlalchemy import Column, String, Integer, LargeBinary, ARRAY, Boolean
-from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import (Column, String, Integer, LargeBinary, Boolean,
+                        DateTime, Numeric, JSON, Index, event, func, inspect, select,
+                        tuple_, update, bindparam)
+from sqlalchemy.dialects.postgresql import ARRAY, JSONB
+from sqlalchemy.orm import joinedload, contains_eager, make_transient_to_detached
 from flask_login import UserMixin
+from cache import cache, MemoryBackend
+from db_pool import engine_options
+from replica import RoutingSQLAlchemy, REPLICA_BIND, mark_write
+from serializers import serialize_row, sparse_serializer
 
 # database_path = 'postgresql://postgres@localhost:5432/menu-db-v1'
 database_path = os.environ['DATABASE_URL']
 
-db = SQLAlchemy()
+db = RoutingSQLAlchemy()
+event.listen(db.session, 'before_flush', mark_write)
+
+
+def fix_database_url(url):
+    if url.startswith("postgres://"):
+        url = url.replace("postgres://", "postgresql://", 1)
+    return url
 
 
 def setup_db(app, database_path=database_path):
-    if database_path.startswith("postgres://"):
-        database_path = database_path.replace(
-            "postgres://", "postgresql://", 1)
+    database_path = fix_database_url(database_path)
     app.config['SQLALCHEMY_DATABASE_URI'] = database_path
+    if app.config.get('DATABASE_REPLICA_URL'):
+        app.config['SQLALCHEMY_BINDS'] = {
+            REPLICA_BIND: fix_database_url(app.config['DATABASE_REPLICA_URL'])
+        }
     app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(
+        app.config, database_path)
     db.app = app
     db.init_app(app)
+    cache.init_app(app)
+    user_cache.init_app(app)
     # db_drop_and_create_all()
 
 
-def db_drop_and_create_all():
+def dispose_engines():
+    '''Forget pooled connections inherited from a parent process. Called
+    from gunicorn's post_fork hook: with --preload the engine may exist
+    before the fork, and sockets must never be shared between workers.
+    close=False leaves the parent's connections untouched.'''
+    if db.app is None:
+        return
+
+    with db.app.app_context():
+        for bind in [None] + list(db.app.config.get('SQLALCHEMY_BINDS') or ()):
+            db.get_engine(bind=bind).dispose(close=False)
+
+
+def db_drop_and_create_all(restaurants=0, items_per_restaurant=0, seed=0):
     db.drop_all()
     db.create_all()
 
@@ -51,6 +88,212 @@ def db_drop_and_create_all():
     # db.session.add(item)
     # db.session.commit()
 
+    if restaurants:
+        seed_db(restaurants, items_per_restaurant, seed)
+
+
+SEED_CITIES = [
+    ('Floripa', 'Santa Catarina - Brasil'),
+    ('Sao Paulo', 'Sao Paulo - Brasil'),
+    ('Porto Alegre', 'Rio Grande do Sul - Brasil'),
+    ('Curitiba', 'Parana - Brasil'),
+    ('Rio de Janeiro', 'Rio de Janeiro - Brasil'),
+]
+SEED_KINDS = ['Padaria', 'Cantina', 'Bistro', 'Pizzaria', 'Cafe', 'Boteco']
+SEED_NAMES = ['Veronese', 'da Praia', 'do Centro', 'Aurora', 'Bella Italia',
+              'Sabor Caseiro', 'Dona Maria', 'Mar Azul', 'Bom Garfo']
+SEED_SECTIONS = {
+    'Entradas': ['Bruschetta', 'Pastel', 'Bolinho de bacalhau', 'Carpaccio'],
+    'Pratos Principais': ['Moqueca', 'Feijoada', 'Risoto', 'File ao molho'],
+    'Massas': ['Lasanha', 'Nhoque', 'Espaguete', 'Ravioli'],
+    'Pizzas': ['Margherita', 'Calabresa', 'Quatro queijos', 'Portuguesa'],
+    'Saladas': ['Salada caprese', 'Salada verde', 'Salada de quinoa'],
+    'Paes': ['Pao italiano', 'Pao de fermentacao natural', 'Focaccia'],
+    'Sobremesas': ['Pudim', 'Brigadeiro', 'Tiramisu', 'Torta de limao'],
+    'Bebidas': ['Suco natural', 'Cafe expresso', 'Cha gelado', 'Caipirinha'],
+}
+SEED_STYLES = ['classico', 'da casa', 'especial', 'tradicional', 'rustico']
+SEED_CATEGORIES = ['vegetariano', 'vegano', 'sem gluten', 'sem lactose',
+                   'picante', 'organico']
+
+
+def seed_db(restaurants, items_per_restaurant, seed=0, batch_size=1000):
+    '''Add synthetic restaurants, each with items_per_restaurant items
+    spread over realistic sections and categories. The same seed always
+    produces the same data.'''
+    rng = random.Random(seed)
+
+    new_restaurants = []
+    for n in range(restaurants):
+        name = f'{rng.choice(SEED_KINDS)} {rng.choice(SEED_NAMES)}'
+        city, state = rng.choice(SEED_CITIES)
+        new_restaurants.append(Restaurant(
+            name=name,
+            slug=f"{name.lower().replace(' ', '-')}-{n}",
+            description=f'{name}, cozinha {rng.choice(SEED_STYLES)} em {city}',
+            city=city,
+            state=state,
+            address=f'Rua {rng.choice(SEED_NAMES)}, {rng.randint(1, 999)}',
+            phone=f'+55 48 9{rng.randint(1000, 9999)}-{rng.randint(1000, 9999)}'
+        ))
+    db.session.add_all(new_restaurants)
+    db.session.flush()
+
+    items = []
+    for restaurant in new_restaurants:
+        for n in range(items_per_restaurant):
+            section = rng.choice(list(SEED_SECTIONS))
+            name = (f'{rng.choice(SEED_SECTIONS[section])} '
+                    f'{rng.choice(SEED_STYLES)}')
+            items.append({
+                'section': section,
+                'name': name,
+                'shortDescription': f'{name} preparado na hora com '
+                                    f'ingredientes selecionados.',
+                'price': Decimal(rng.randint(500, 15000)) / 100,
+                'imageUrl': f'https://images.example.com/items/{n}.jpg',
+                'categories': rng.sample(SEED_CATEGORIES, rng.randint(0, 3)),
+                'restaurant_id': restaurant.id
+            })
+            if len(items) >= batch_size:
+                db.session.execute(Item.__table__.insert(), items)
+                items = []
+    if items:
+        db.session.execute(Item.__table__.insert(), items)
+
+    queue_menu_rebuild(db.session, [r.id for r in new_restaurants])
+    db.session.commit()
+
+
+ITEM_FIELDS = ('section', 'name', 'shortDescription', 'price', 'imageUrl',
+               'categories')
+
+
+PRICE_PATTERN = re.compile(r'^\d{1,8}(\.\d{1,2})?$')
+# "1.234,56", "1,234.56", "1.234": groups of three, then maybe decimals
+# behind the other separator
+GROUPED_PRICE_PATTERN = re.compile(
+    r'^\d{1,3}(?P<sep>[.,])\d{3}(?:(?P=sep)\d{3})*(?:(?!(?P=sep))[.,]\d{1,2})?$')
+
+
+def parse_price(value):
+    '''Turn a price given as a number or a string such as "69.90",
+    "69,90", "R$ 69,90" or "R$ 1.234,56" into a Decimal. Raises
+    ValueError.'''
+    if value is None or value == '':
+        return None
+    if isinstance(value, bool):
+        raise ValueError('price must be a number or a string')
+    if isinstance(value, (int, float, Decimal)):
+        value = str(value)
+    if not isinstance(value, str):
+        raise ValueError('price must be a number or a string')
+
+    text = value.replace('R$', '').strip()
+    grouped = GROUPED_PRICE_PATTERN.match(text)
+    if grouped:
+        text = text.replace(grouped.group('sep'), '')
+    text = text.replace(',', '.')
+    if not PRICE_PATTERN.match(text):
+        raise ValueError(f'invalid price: {value!r}')
+
+    try:
+        return Decimal(text).quantize(Decimal('0.01'))
+    except InvalidOperation:
+        raise ValueError(f'invalid price: {value!r}')
+
+
+def validate_item(data, partial=False):
+    '''Check an item payload and return the column values to insert.
+    With partial=True only the fields present are checked and returned,
+    for updates. Raises ValueError describing the first problem found.'''
+    if not isinstance(data, dict):
+        raise ValueError('item must be an object')
+
+    item = {}
+    for field in ITEM_FIELDS:
+        if partial and field not in data:
+            continue
+        value = data.get(field)
+        item[field] = None if value == '' else value
+
+    if not isinstance(item.get('name', ''), str):
+        raise ValueError('name is required')
+    for field in ('section', 'shortDescription', 'imageUrl'):
+        if item.get(field) is not None and not isinstance(item[field], str):
+            raise ValueError(f'{field} must be a string')
+    if item.get('section') is not None and len(item['section']) > 100:
+        raise ValueError('section must be at most 100 characters')
+
+    if 'price' in item:
+        item['price'] = parse_price(item['price'])
+
+    categories = item.get('categories')
+    if categories is not None and (
+            not isinstance(categories, list) or
+            not all(isinstance(category, str) for category in categories)):
+        raise ValueError('categories must be a list of strings')
+
+    return item
+
+
+def id_cursor(row):
+    return str(row.id)
+
+
+def price_cursor(row):
+    return f'{row.price}:{row.id}'
+
+
+def parse_price_cursor(cursor):
+    '''Inverse of price_cursor. Raises ValueError.'''
+    price, _, id = cursor.rpartition(':')
+    return parse_price(price), int(id)
+
+
+def select_columns(model, fields=None, paging_fields=('id',)):
+    '''Columns to select for the requested fields (every public field when
+    fields is None) plus the ones paging needs. Raises ValueError on an
+    unknown field.'''
+    if fields is None:
+        names = list(model.public_fields)
+    else:
+        unknown = set(fields) - set(model.public_fields)
+        if unknown:
+            raise ValueError(f"unknown fields: {', '.join(sorted(unknown))}")
+        names = list(fields)
+
+    names += [name for name in paging_fields if name not in names]
+    return [getattr(model, name) for name in names]
+
+
+def paginate(query, limit, cursor=id_cursor, serialize=serialize_row):
+    '''Run an ordered query and return one page of dicts plus the cursor
+    of the next page, or None when this is the last page.'''
+    rows = query.limit(limit + 1).all()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = cursor(rows[-1])
+
+    return [serialize(row) for row in rows], next_cursor
+
+
+def build_menu(restaurant, items):
+    '''Menu document: the restaurant dict plus its item dicts grouped by
+    section, sections in order of their first item.'''
+    sections = {}
+    for item in items:
+        sections.setdefault(item['section'], []).append(item)
+
+    menu = dict(restaurant)
+    menu['sections'] = [
+        {'section': section, 'items': items}
+        for section, items in sections.items()
+    ]
+    return menu
+
 
 class Restaurant(db.Model):
     __tablename__ = 'restaurants'
@@ -59,17 +302,28 @@ class Restaurant(db.Model):
     name = Column(String, nullable=False)
     slug = Column(String, unique=True)
     description = Column(String)
-    city = Column(String)
-    state = Column(String)
+    city = Column(String, index=True)
+    state = Column(String, index=True)
     address = Column(String)
     phone = Column(String)
     imageUrl = Column(String)
     websiteUrl = Column(String)
     instagramUrl = Column(String)
     facebookUrl = Column(String)
-    items = db.relationship('Item', backref='restaurant', lazy=True)
+    revision = Column(Integer, nullable=False, default=1, server_default='1')
+    updated_at = Column(DateTime, nullable=False, default=datetime.utcnow,
+                        server_default=func.now())
+    # to_menu_dict() output, rebuilt in the writing transaction (see
+    # rebuild_menu_documents); NULL until the first rebuild
+    menu_document = Column(JSONB().with_variant(JSON, 'sqlite'))
+    items = db.relationship('Item', backref='restaurant', lazy=True,
+                            order_by='Item.id')
     users = db.relationship('User', backref='restaurant', lazy=True)
 
+    public_fields = ('id', 'name', 'slug', 'description', 'city', 'state',
+                     'address', 'phone', 'imageUrl', 'websiteUrl',
+                     'instagramUrl', 'facebookUrl')
+
     def to_dict(self):
         return {
             'id': self.id,
@@ -86,11 +340,183 @@ class Restaurant(db.Model):
             'facebookUrl': self.facebookUrl
         }
 
-    def get_restaurant(_slug):
-        return [Restaurant.to_dict(Restaurant.query.filter_by(slug=_slug).first())]
+    def to_menu_dict(self):
+        '''Items in the order they were loaded: by id, or as sorted by
+        the query that eager loaded them (see get_filtered_menu).'''
+        return build_menu(self.to_dict(), [
+            item.to_dict() for item in self.items])
+
+    def get_version(_slug):
+        '''id, revision and updated_at of a restaurant, all of which
+        tag its responses: a slug can be deleted and reused, or renamed
+        onto another restaurant, at an equal revision, and SQLite may
+        even reuse the id.'''
+        return Restaurant.query.with_entities(
+            Restaurant.id, Restaurant.revision,
+            Restaurant.updated_at).filter_by(slug=_slug).first()
+
+    def get_catalog_version():
+        '''(revision, updated_at) of the whole catalog: every restaurant
+        or item write, deletions included, moves it.'''
+        version = Catalog.query.with_entities(
+            Catalog.revision, Catalog.updated_at).filter_by(id=1).first()
+        return tuple(version) if version is not None else (0, None)
+
+    def get_menu(version):
+        '''The menu of the restaurant at version, as given by get_version.
+        The version is the cache key, so a write is seen by every process
+        as soon as it commits, and a reused slug never hits the entry of
+        the restaurant that had it before.'''
+        def load():
+            row = Restaurant.query.with_entities(
+                Restaurant.menu_document).filter_by(id=version.id).first()
+            if row is None:
+                return None
+            if row.menu_document is not None:
+                return row.menu_document
+
+            # not built yet (run "manage.py rebuild_menus" after migrating)
+            restaurant = Restaurant.query.options(
+                joinedload(Restaurant.items)).filter_by(id=version.id).first()
+            return restaurant.to_menu_dict()
+
+        return cache.get_or_set('menu', tuple(version), load, versioned=True)
+
+    def get_menu_changes(_slug, since):
+        '''Delta of a menu since revision since: the items created or
+        changed after it and the ids of the items deleted after it.'''
+        restaurant = Restaurant.query.filter_by(slug=_slug).first()
+        if restaurant is None:
+            return None
+
+        items = [serialize_row(row) for row in Item.query.with_entities(
+            *select_columns(Item)).filter(
+            Item.restaurant_id == restaurant.id,
+            Item.revision > since).order_by(Item.id)]
+
+        # an item can leave and come back (moved between restaurants)
+        present = {item['id'] for item in items}
+        deleted = [row_id for row_id, in Tombstone.query.with_entities(
+            Tombstone.row_id).filter(
+            Tombstone.table_name == 'items',
+            Tombstone.restaurant_id == restaurant.id,
+            Tombstone.revision > since).order_by(Tombstone.row_id).distinct()
+            if row_id not in present]
+
+        return {
+            'Restaurant': restaurant.to_dict(),
+            'revision': restaurant.revision,
+            'since': since,
+            'Items': items,
+            'deleted': deleted
+        }
+
+    def get_filtered_menu(_slug, min_price=None, max_price=None, sort='id'):
+        conditions = []
+        if min_price is not None:
+            conditions.append(Item.price >= min_price)
+        if max_price is not None:
+            conditions.append(Item.price <= max_price)
+
+        if sort == 'price':
+            order = (Item.price.nullslast(), Item.id)
+        else:
+            order = (Item.id,)
+
+        # no first(): its LIMIT 1 would cut the joined item rows
+        restaurants = Restaurant.query.outerjoin(
+            Restaurant.items.and_(*conditions)
+        ).options(
+            contains_eager(Restaurant.items)
+        ).filter(Restaurant.slug == _slug).order_by(
+            *order).populate_existing().all()
+
+        if not restaurants:
+            return None
+        return restaurants[0].to_menu_dict()
+
+    def get_restaurant(version):
+        '''The restaurant at version, cached like get_menu.'''
+        def load():
+            restaurant = Restaurant.query.get(version.id)
+            if restaurant is None:
+                return None
+            return [restaurant.to_dict()]
+
+        return cache.get_or_set('restaurant', tuple(version), load,
+                                versioned=True)
 
-    def get_all_restaurants():
-        return [Restaurant.to_dict(restaurant) for restaurant in Restaurant.query.all()]
+    def get_restaurants_by(slugs=None, ids=None, fields=None, menus=False):
+        '''Restaurants looked up by slug or by id in one IN query, in the
+        order asked for, and the slugs or ids that were not found. With
+        menus the stored menu documents are returned instead, and menus
+        not built yet come from one batched item query.'''
+        key = 'slug' if slugs is not None else 'id'
+        keys = slugs if slugs is not None else ids
+
+        columns = select_columns(Restaurant, fields, paging_fields=(key,))
+        if menus:
+            columns.append(Restaurant.menu_document)
+        serialize = sparse_serializer(fields)
+
+        found = {}
+        unbuilt = {}
+        for row in Restaurant.query.with_entities(*columns).filter(
+                getattr(Restaurant, key).in_(keys)):
+            if not menus:
+                found[getattr(row, key)] = serialize(row)
+            elif row.menu_document is not None:
+                found[getattr(row, key)] = row.menu_document
+            else:
+                restaurant = serialize_row(row)
+                del restaurant['menu_document']
+                unbuilt[row.id] = (getattr(row, key), restaurant)
+
+        if unbuilt:
+            items = {}
+            for row in Item.query.with_entities(*select_columns(Item)).filter(
+                    Item.restaurant_id.in_(unbuilt)).order_by(Item.id):
+                items.setdefault(row.restaurant_id, []).append(
+                    serialize_row(row))
+            for restaurant_id, (value, restaurant) in unbuilt.items():
+                found[value] = build_menu(
+                    restaurant, items.get(restaurant_id, []))
+
+        return ([found[value] for value in keys if value in found],
+                [value for value in keys if value not in found])
+
+    def get_all_restaurants(version):
+        '''Every restaurant, cached under the catalog version.'''
+        return cache.get_or_set('restaurants', ('all', version), lambda: [
+            serialize_row(row) for row in
+            Restaurant.query.with_entities(*select_columns(Restaurant))],
+            versioned=True)
+
+    def iter_all_restaurants(batch_size):
+        query = Restaurant.query.with_entities(
+            *select_columns(Restaurant)).order_by(Restaurant.id)
+        for row in query.yield_per(batch_size):
+            yield serialize_row(row)
+
+    def get_restaurants_page(limit, after=None, city=None, state=None,
+                             fields=None, version=None):
+        '''version is the catalog version the page is cached under.'''
+        query = Restaurant.query.with_entities(
+            *select_columns(Restaurant, fields))
+
+        if after is not None:
+            query = query.filter(Restaurant.id > after)
+        if city is not None:
+            query = query.filter(Restaurant.city == city)
+        if state is not None:
+            query = query.filter(Restaurant.state == state)
+
+        return cache.get_or_set(
+            'restaurants',
+            ('page', limit, after, city, state, fields, version),
+            lambda: paginate(query.order_by(Restaurant.id), limit,
+                             serialize=sparse_serializer(fields)),
+            versioned=True)
 
     def add(self):
         db.session.add(self)
@@ -148,18 +574,79 @@ class User(UserMixin, db.Model):
         return '<User %r>' % self.username
 
 
+class UserCache:
+    '''Per-process cache of the users behind authenticated requests, so
+    Flask-Login doesn't query the users table on every request. Entries
+    live USER_CACHE_TTL seconds. Commits that update or delete a user
+    drop its entry in this process; other workers see the change when
+    their entry expires. Password hashes are not cached.'''
+
+    # called with 'cache' or 'database' on every lookup; set by metrics.py
+    on_load = None
+
+    def __init__(self):
+        self.backend = MemoryBackend(max_entries=1024, ttl=30)
+
+    def init_app(self, app):
+        self.backend = MemoryBackend(
+            app.config.get('USER_CACHE_MAX_ENTRIES', 1024),
+            app.config.get('USER_CACHE_TTL', 30))
+
+    def get(self, user_id):
+        found, values = self.backend.get(user_id)
+        if self.on_load is not None:
+            self.on_load('cache' if found else 'database')
+
+        if not found:
+            user = User.query.get(user_id)
+            if user is not None:
+                self.backend.set(user_id, {
+                    column.key: getattr(user, column.key)
+                    for column in User.__table__.columns
+                    if column.key != 'password'
+                })
+            return user
+
+        # a detached copy merged without loading: no query, and the
+        # password is loaded on access only
+        user = User(**values)
+        make_transient_to_detached(user)
+        return db.session.merge(user, load=False)
+
+    def invalidate(self, user_id):
+        self.backend.delete(user_id)
+
+
+user_cache = UserCache()
+
+
 class Item(db.Model):
     __tablename__ = 'items'
 
     id = Column(Integer, primary_key=True)
-    section = Column(String(100))
+    section = Column(String(100), index=True)
     name = Column(String)
     shortDescription = Column(String)
-    price = Column(String)
+    price = Column(Numeric(10, 2))
     imageUrl = Column(String)
-    categories = Column(ARRAY(String))
+    # JSON stands in for ARRAY when running against SQLite locally
+    categories = Column(ARRAY(String).with_variant(JSON, 'sqlite'))
     restaurant_id = Column(Integer, db.ForeignKey(
-        'restaurants.id'), nullable=False)
+        'restaurants.id'), nullable=False, index=True)
+    # revision of the restaurant's menu at the item's last change
+    revision = Column(Integer, nullable=False, default=1, server_default='1')
+    updated_at = Column(DateTime, nullable=False, default=datetime.utcnow,
+                        server_default=func.now())
+
+    __table_args__ = (
+        Index('ix_items_categories', categories, postgresql_using='gin'),
+        Index('ix_items_price_id', price, id),
+        Index('ix_items_restaurant_id_price', restaurant_id, price),
+        Index('ix_items_restaurant_id_revision', restaurant_id, revision),
+    )
+
+    public_fields = ('id', 'section', 'name', 'shortDescription', 'price',
+                     'imageUrl', 'categories', 'restaurant_id')
 
     def to_dict(self):
         return {
@@ -167,13 +654,197 @@ class Item(db.Model):
             'section': self.section,
             'name': self.name,
             'shortDescription': self.shortDescription,
-            'price': self.price,
+            'price': None if self.price is None else str(self.price),
             'imageUrl': self.imageUrl,
-            'categories': self.categories
+            'categories': self.categories,
+            'restaurant_id': self.restaurant_id
         }
 
-    def get_all_items():
-        return [Item.to_dict(item) for item in Item.query.all()]
+    def get_all_items(version):
+        '''Every item, cached under the catalog version.'''
+        return cache.get_or_set('items', ('all', version), lambda: [
+            serialize_row(row) for row in
+            Item.query.with_entities(*select_columns(Item))],
+            versioned=True)
+
+    def iter_all_items(batch_size):
+        query = Item.query.with_entities(
+            *select_columns(Item)).order_by(Item.id)
+        for row in query.yield_per(batch_size):
+            yield serialize_row(row)
+
+    def bulk_add(restaurant_id, rows, batch_size):
+        '''Validate rows and insert the valid ones in a single transaction
+        with batched executemany. Returns the number of inserted rows and
+        a list of per-row errors.'''
+        items = []
+        errors = []
+        for index, row in enumerate(rows):
+            try:
+                item = validate_item(row)
+            except ValueError as error:
+                errors.append({'row': index, 'error': str(error)})
+                continue
+            item['restaurant_id'] = restaurant_id
+            items.append(item)
+
+        if items:
+            try:
+                # core inserts skip the flush hook, so do its work here
+                bump_revisions(db.session, {restaurant_id})
+                revision = pending_revision(db.session, restaurant_id)
+                for item in items:
+                    item['revision'] = revision
+                for start in range(0, len(items), batch_size):
+                    db.session.execute(
+                        Item.__table__.insert(),
+                        items[start:start + batch_size]
+                    )
+                record_changes(db.session, restaurant_id, None)
+                mark_stale(db.session, {'items'})
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+                raise
+
+        return len(items), errors
+
+    def bulk_update(restaurant_id, rows):
+        '''Apply partial updates given as {id, ...fields} to items of one
+        restaurant in a single transaction. Nothing is written unless
+        every row is valid and every id belongs to the restaurant.
+        Returns the changed items and a list of per-row errors.'''
+        changes = {}
+        errors = []
+        for index, row in enumerate(rows):
+            item_id = row.get('id') if isinstance(row, dict) else None
+            if not isinstance(item_id, int) or isinstance(item_id, bool):
+                errors.append({'row': index, 'error': 'id is required'})
+                continue
+            if item_id in changes:
+                errors.append({'row': index, 'error': f'duplicate id {item_id}'})
+                continue
+            try:
+                changes[item_id] = validate_item(row, partial=True)
+            except ValueError as error:
+                errors.append({'row': index, 'error': str(error)})
+
+        if errors or not changes:
+            return [], errors
+
+        try:
+            current = {
+                row.id: row for row in db.session.execute(
+                    select(*select_columns(Item))
+                    .where(Item.id.in_(changes),
+                           Item.restaurant_id == restaurant_id)
+                    .with_for_update())
+            }
+            errors = [
+                {'id': item_id, 'error': 'item not found in this restaurant'}
+                for item_id in changes if item_id not in current
+            ]
+            if errors:
+                db.session.rollback()
+                return [], errors
+
+            mappings = []
+            for item_id, values in changes.items():
+                changed = {field: value for field, value in values.items()
+                           if getattr(current[item_id], field) != value}
+                if changed:
+                    changed['id'] = item_id
+                    mappings.append(changed)
+
+            if not mappings:
+                db.session.rollback()
+                return [], []
+
+            # executemany UPDATE per set of changed columns; bulk
+            # operations skip the flush hook, so do its work here
+            bump_revisions(db.session, {restaurant_id})
+            revision = pending_revision(db.session, restaurant_id)
+            now = datetime.utcnow()
+            for mapping in mappings:
+                mapping.update(revision=revision, updated_at=now)
+            db.session.bulk_update_mappings(Item, mappings)
+            mark_stale(db.session, {'items'})
+
+            changed_ids = [mapping['id'] for mapping in mappings]
+            updated = [
+                serialize_row(row) for row in db.session.execute(
+                    select(*select_columns(Item))
+                    .where(Item.id.in_(changed_ids))
+                    .order_by(Item.id))
+            ]
+            record_changes(db.session, restaurant_id, [
+                {'type': 'item', 'action': 'updated', 'Item': item}
+                for item in updated])
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+
+        return updated, []
+
+    def categories_filter(categories, match_all):
+        '''Items in all (match_all) or any of categories. On Postgres @>
+        and && are both served by the GIN index on categories; SQLite's
+        JSON arrays are searched with json_each.'''
+        if db.session.get_bind().dialect.name != 'sqlite':
+            if match_all:
+                return Item.categories.contains(categories)
+            return Item.categories.overlap(categories)
+
+        values = func.json_each(Item.categories).table_valued('value')
+        matched = select(func.count(func.distinct(values.c.value))).where(
+            values.c.value.in_(categories)).scalar_subquery()
+        if match_all:
+            return matched == len(set(categories))
+        return matched > 0
+
+    def get_items_page(limit, after=None, restaurant_id=None, section=None,
+                       categories=None, match_all=True, min_price=None,
+                       max_price=None, sort='id', fields=None, version=None):
+        '''One page of items. With sort='id' the after cursor is an item
+        id; with sort='price' it is a (price, id) pair and items without
+        a price are left out. fields narrows the selected columns.
+        version is the catalog version the page is cached under.'''
+        paging_fields = ('id', 'price') if sort == 'price' else ('id',)
+        query = Item.query.with_entities(
+            *select_columns(Item, fields, paging_fields))
+
+        if sort == 'price':
+            query = query.filter(Item.price.isnot(None))
+            if after is not None:
+                query = query.filter(tuple_(Item.price, Item.id) > tuple_(*after))
+            query = query.order_by(Item.price, Item.id)
+            cursor = price_cursor
+        else:
+            if after is not None:
+                query = query.filter(Item.id > after)
+            query = query.order_by(Item.id)
+            cursor = id_cursor
+
+        if min_price is not None:
+            query = query.filter(Item.price >= min_price)
+        if max_price is not None:
+            query = query.filter(Item.price <= max_price)
+        if restaurant_id is not None:
+            query = query.filter(Item.restaurant_id == restaurant_id)
+        if section is not None:
+            query = query.filter(Item.section == section)
+        if categories:
+            query = query.filter(
+                Item.categories_filter(categories, match_all))
+
+        return cache.get_or_set(
+            'items', ('page', limit, after, restaurant_id, section,
+                      tuple(categories or ()), match_all, min_price,
+                      max_price, sort, fields, version),
+            lambda: paginate(query, limit, cursor,
+                             serialize=sparse_serializer(fields)),
+            versioned=True)
 
     def add(self):
         db.session.add(self)
@@ -188,3 +859,322 @@ class Item(db.Model):
 
     def __repr__(self):
         return f'Item {self.id}: {self.name}'
+
+
+class Tombstone(db.Model):
+    '''A deleted item or restaurant, kept so delta syncs can report it.
+    restaurant_id has no foreign key: the restaurant may be gone too.'''
+    __tablename__ = 'tombstones'
+
+    id = Column(Integer, primary_key=True)
+    table_name = Column(String(50), nullable=False)
+    row_id = Column(Integer, nullable=False)
+    restaurant_id = Column(Integer, nullable=False)
+    revision = Column(Integer, nullable=False)
+    deleted_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+
+    __table_args__ = (
+        Index('ix_tombstones_restaurant_id_revision', restaurant_id, revision),
+    )
+
+    def __repr__(self):
+        return f'Tombstone {self.table_name} {self.row_id}'
+
+
+class Catalog(db.Model):
+    '''Single row counting every write to restaurants and items, so list
+    responses are versioned by one primary key lookup. Bumped by
+    bump_catalog() in the writing transaction.'''
+    __tablename__ = 'catalog'
+
+    id = Column(Integer, primary_key=True)
+    revision = Column(Integer, nullable=False, default=0)
+    updated_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f'Catalog {self.revision}'
+
+
+def bump_catalog(session):
+    '''Increment the catalog revision inside the current transaction. The
+    row is locked until commit, so writes to the catalog serialize.'''
+    connection = session.connection()
+    now = datetime.utcnow()
+    result = connection.execute(
+        update(Catalog.__table__)
+        .where(Catalog.id == 1)
+        .values(revision=Catalog.revision + 1, updated_at=now)
+    )
+    if result.rowcount == 0:
+        connection.execute(Catalog.__table__.insert().values(
+            id=1, revision=1, updated_at=now))
+
+
+def bump_revisions(session, restaurant_ids):
+    '''Increment the revision of the given restaurants, and the catalog's,
+    inside the current transaction. Every bump queues one menu change
+    event, filled in by record_changes().'''
+    bump_catalog(session)
+    connection = session.connection()
+    connection.execute(
+        update(Restaurant.__table__)
+        .where(Restaurant.id.in_(restaurant_ids))
+        .values(revision=Restaurant.revision + 1,
+                updated_at=datetime.utcnow())
+    )
+
+    for obj in session.identity_map.values():
+        if isinstance(obj, Restaurant) and obj.id in restaurant_ids:
+            session.expire(obj, ['revision', 'updated_at'])
+
+    rows = connection.execute(
+        select(Restaurant.id, Restaurant.slug, Restaurant.revision)
+        .where(Restaurant.id.in_(restaurant_ids))
+    ).all()
+
+    queue_menu_rebuild(session, restaurant_ids)
+    pending = session.info.setdefault('menu_events', {})
+    for row in rows:
+        pending[row.id] = {'slug': row.slug, 'revision': row.revision,
+                           'changes': []}
+
+
+def pending_revision(session, restaurant_id):
+    '''Revision given to a restaurant by bump_revisions in this flush.'''
+    return session.info['menu_events'][restaurant_id]['revision']
+
+
+def record_changes(session, restaurant_id, changes):
+    '''Attach changes to the pending event of a bumped restaurant. None
+    means the changes are not itemized (bulk writes), so subscribers
+    reload the whole menu.'''
+    entry = session.info.get('menu_events', {}).get(restaurant_id)
+    if entry is None:
+        return
+    if changes is None or entry['changes'] is None:
+        entry['changes'] = None
+    else:
+        entry['changes'].extend(changes)
+
+
+def mark_stale(session, namespaces):
+    '''Queue cache invalidations to run once the transaction commits.
+    Restaurant and menu entries are keyed by revision instead.'''
+    session.info.setdefault('stale_cache', set()).update(namespaces)
+
+
+def queue_menu_rebuild(session, restaurant_ids):
+    session.info.setdefault('stale_menus', set()).update(restaurant_ids)
+
+
+def write_menu_documents(connection, restaurant_ids):
+    '''Rebuild the menu_document of the given restaurants from their
+    current rows: one query for the restaurants, one for their items and
+    one executemany UPDATE.'''
+    restaurant_ids = list(restaurant_ids)
+    if not restaurant_ids:
+        return
+
+    items = {}
+    for row in connection.execute(
+            select(*select_columns(Item))
+            .where(Item.restaurant_id.in_(restaurant_ids))
+            .order_by(Item.id)):
+        items.setdefault(row.restaurant_id, []).append(serialize_row(row))
+
+    documents = [
+        {
+            'restaurant_id': row.id,
+            'document': build_menu(serialize_row(row), items.get(row.id, []))
+        }
+        for row in connection.execute(
+            select(*select_columns(Restaurant))
+            .where(Restaurant.id.in_(restaurant_ids)))
+    ]
+    if documents:
+        connection.execute(
+            update(Restaurant.__table__)
+            .where(Restaurant.id == bindparam('restaurant_id'))
+            .values(menu_document=bindparam('document')),
+            documents
+        )
+
+
+@event.listens_for(db.session, 'after_flush')
+@event.listens_for(db.session, 'before_commit')
+def rebuild_menu_documents(session, flush_context=None):
+    '''Rebuild the menus queued by bump_revisions, and those of new
+    restaurants, in the transaction that changed them. Flushes rebuild
+    right away; core writes (bulk_add, seeding) are rebuilt before
+    commit.'''
+    if flush_context is not None:
+        queue_menu_rebuild(session, [
+            obj.id for obj in session.new if isinstance(obj, Restaurant)])
+
+    restaurant_ids = session.info.pop('stale_menus', None)
+    if not restaurant_ids:
+        return
+
+    write_menu_documents(session.connection(), restaurant_ids)
+    for obj in session.identity_map.values():
+        if isinstance(obj, Restaurant) and obj.id in restaurant_ids:
+            session.expire(obj, ['menu_document'])
+
+
+def rebuild_all_menu_documents(batch_size=100):
+    '''Rebuild every menu document, batch_size restaurants per
+    transaction.'''
+    ids = [id for id, in Restaurant.query.with_entities(
+        Restaurant.id).order_by(Restaurant.id)]
+    for start in range(0, len(ids), batch_size):
+        write_menu_documents(db.session.connection(),
+                             ids[start:start + batch_size])
+        db.session.commit()
+    return len(ids)
+
+
+def item_restaurant_ids(item):
+    '''The restaurant an item belongs to once flushed, and the ones it
+    leaves. Flask-Admin assigns the restaurant relationship, which only
+    reaches restaurant_id during the flush, so both are looked at.'''
+    state = inspect(item)
+    restaurant = state.dict.get('restaurant')
+    target = restaurant.id if restaurant is not None else item.restaurant_id
+
+    old_ids = {item.restaurant_id}
+    old_ids.update(state.attrs.restaurant_id.history.deleted or ())
+    old_ids.update(old.id for old in
+                   state.attrs.restaurant.history.deleted or ()
+                   if old is not None)
+    return target, old_ids - {target, None}
+
+
+@event.listens_for(db.session, 'before_flush')
+def track_menu_changes(session, flush_context, instances):
+    '''Bump the revision of every restaurant touched by this flush, either
+    directly or through one of its items, and queue the cache entries it
+    makes stale. Listening on the session means Flask-Admin edits are
+    covered as well as the model methods.'''
+    restaurant_ids = set()
+    namespaces = set()
+    items = []
+    moved = []
+    new_restaurants = False
+    deleted_restaurants = []
+
+    for obj in session.new | session.dirty | session.deleted:
+        if obj in session.dirty and not session.is_modified(obj):
+            continue
+
+        if isinstance(obj, Restaurant):
+            namespaces.add('restaurants')
+            if obj in session.dirty:
+                restaurant_ids.add(obj.id)
+            elif obj in session.deleted:
+                deleted_restaurants.append(obj)
+            else:
+                new_restaurants = True
+        elif isinstance(obj, Item):
+            namespaces.add('items')
+            target, old_ids = item_restaurant_ids(obj)
+            restaurant_ids.add(target)
+            items.append((obj, target))
+            # an item moved to another restaurant changes both menus
+            for old_id in old_ids:
+                restaurant_ids.add(old_id)
+                moved.append((obj, old_id))
+
+    restaurant_ids.discard(None)
+    if restaurant_ids:
+        bump_revisions(session, restaurant_ids)
+    elif new_restaurants or deleted_restaurants:
+        bump_catalog(session)
+
+    # stamp items with the new menu revision; deletions leave tombstones
+    now = datetime.utcnow()
+    for item, target in items:
+        if target not in restaurant_ids:
+            continue
+        revision = pending_revision(session, target)
+        if item in session.deleted:
+            session.add(Tombstone(table_name='items', row_id=item.id,
+                                  restaurant_id=target,
+                                  revision=revision))
+        else:
+            item.revision = revision
+            item.updated_at = now
+    for item, old_id in moved:
+        session.add(Tombstone(table_name='items', row_id=item.id,
+                              restaurant_id=old_id,
+                              revision=pending_revision(session, old_id)))
+    for restaurant in deleted_restaurants:
+        session.add(Tombstone(
+            table_name='restaurants', row_id=restaurant.id,
+            restaurant_id=restaurant.id,
+            revision=(inspect(restaurant).dict.get('revision') or 0) + 1))
+
+    if namespaces:
+        mark_stale(session, namespaces)
+
+
+@event.listens_for(db.session, 'after_flush')
+def collect_menu_changes(session, flush_context):
+    '''Describe what this flush changed on the events queued by
+    track_menu_changes. Runs after the flush so new rows have ids.'''
+    for obj in session.new | session.dirty | session.deleted:
+        if obj in session.dirty and not session.is_modified(obj):
+            continue
+
+        if obj in session.new:
+            action = 'created'
+        elif obj in session.deleted:
+            action = 'deleted'
+        else:
+            action = 'updated'
+
+        if isinstance(obj, Item):
+            target, old_ids = item_restaurant_ids(obj)
+            data = {'id': obj.id} if action == 'deleted' else obj.to_dict()
+            record_changes(session, target, [
+                {'type': 'item', 'action': action, 'Item': data}])
+            for old_id in old_ids:
+                record_changes(session, old_id, [
+                    {'type': 'item', 'action': 'deleted',
+                     'Item': {'id': obj.id}}])
+        elif isinstance(obj, Restaurant) and action == 'updated':
+            record_changes(session, obj.id, [
+                {'type': 'restaurant', 'action': action,
+                 'Restaurant': obj.to_dict()}])
+        elif isinstance(obj, Restaurant) and action == 'deleted':
+            # a deleted restaurant is not bumped; announce it one past
+            # the last revision its subscribers saw
+            state = inspect(obj).dict
+            session.info.setdefault('menu_events', {})[obj.id] = {
+                'slug': state.get('slug'),
+                'revision': (state.get('revision') or 0) + 1,
+                'changes': [{'type': 'restaurant', 'action': action,
+                             'Restaurant': {'id': obj.id}}]
+            }
+
+
+@event.listens_for(db.session, 'after_flush')
+def collect_stale_users(session, flush_context):
+    for obj in session.dirty | session.deleted:
+        if isinstance(obj, User):
+            session.info.setdefault('stale_users', set()).add(obj.id)
+
+
+@event.listens_for(db.session, 'after_commit')
+def invalidate_cache(session):
+    for namespace in session.info.pop('stale_cache', ()):
+        cache.invalidate_namespace(namespace)
+    for user_id in session.info.pop('stale_users', ()):
+        user_cache.invalidate(user_id)
+
+
+@event.listens_for(db.session, 'after_rollback')
+def discard_cache_invalidations(session):
+    session.info.pop('stale_cache', None)
+    session.info.pop('menu_events', None)
+    session.info.pop('stale_menus', None)
+    session.info.pop('stale_users', None)
@@ -0,0 +1,114 @@
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+from concurrent.futures.process import BrokenProcessPool
+import bcrypt
+
+
+class PasswordHasherBusy(Exception):
+    '''Raised when BCRYPT_MAX_PENDING hashes are already in flight.'''
+
+
+def hash_password(password, rounds):
+    return bcrypt.hashpw(password, bcrypt.gensalt(rounds))
+
+
+def verify_password(password, pw_hash):
+    return bcrypt.checkpw(password, pw_hash)
+
+
+def hash_rounds(pw_hash):
+    '''Cost of a bcrypt hash such as b"$2b$12$...".'''
+    try:
+        return int(pw_hash.split(b'$')[2])
+    except (IndexError, ValueError):
+        return None
+
+
+class PasswordHasher:
+    '''bcrypt off the request thread. Hashes run in a small process pool,
+    created on first use so every gunicorn worker gets its own after the
+    fork. At most BCRYPT_MAX_PENDING hashes per process are queued or
+    running; beyond that callers fail fast with PasswordHasherBusy
+    instead of tying up the worker. BCRYPT_WORKERS = 0 hashes inline,
+    still under the same cap. Hashes are compatible with Flask-Bcrypt.'''
+
+    def __init__(self, app=None):
+        self.rounds = 12
+        self.workers = 2
+        self.timeout = 5
+        self.pool = None
+        self.lock = threading.Lock()
+        self.slots = threading.BoundedSemaphore(4)
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.rounds = app.config.get('BCRYPT_LOG_ROUNDS', 12)
+        self.workers = app.config.get('BCRYPT_WORKERS', 2)
+        self.timeout = app.config.get('BCRYPT_TIMEOUT', 5)
+        self.slots = threading.BoundedSemaphore(
+            app.config.get('BCRYPT_MAX_PENDING', 4))
+
+    def get_pool(self):
+        with self.lock:
+            if self.pool is None:
+                # spawn, not fork: the worker may be running threads
+                self.pool = ProcessPoolExecutor(
+                    self.workers,
+                    mp_context=multiprocessing.get_context('spawn'))
+            return self.pool
+
+    def discard_pool(self, pool):
+        '''Drop a pool whose process died (e.g. OOM killed) so the next
+        hash starts a new one.'''
+        with self.lock:
+            if self.pool is pool:
+                self.pool = None
+        pool.shutdown(wait=False)
+
+    def run(self, function, *args):
+        if not self.slots.acquire(blocking=False):
+            raise PasswordHasherBusy()
+
+        if not self.workers:
+            try:
+                return function(*args)
+            finally:
+                self.slots.release()
+
+        pool = self.get_pool()
+        try:
+            future = pool.submit(function, *args)
+        except BrokenProcessPool:
+            self.slots.release()
+            self.discard_pool(pool)
+            raise PasswordHasherBusy()
+        # the slot is held until the hash is done, not just until we stop
+        # waiting, so BCRYPT_MAX_PENDING also bounds the pool's queue
+        future.add_done_callback(lambda future: self.slots.release())
+
+        try:
+            return future.result(self.timeout)
+        except TimeoutError:
+            future.cancel()
+            raise PasswordHasherBusy()
+        except BrokenProcessPool:
+            self.discard_pool(pool)
+            raise PasswordHasherBusy()
+
+    def hash(self, password):
+        return self.run(hash_password, password.encode('utf-8'), self.rounds)
+
+    def verify(self, pw_hash, password):
+        if isinstance(pw_hash, str):
+            pw_hash = pw_hash.encode('utf-8')
+        return self.run(verify_password, password.encode('utf-8'), pw_hash)
+
+    def needs_rehash(self, pw_hash):
+        if isinstance(pw_hash, str):
+            pw_hash = pw_hash.encode('utf-8')
+        return hash_rounds(pw_hash) != self.rounds
+
+
+passwords = PasswordHasher()
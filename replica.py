@@ -0,0 +1,104 @@
+import time
+import threading
+from functools import wraps
+from flask import g, request, has_request_context, current_app
+from flask_sqlalchemy import SQLAlchemy, SignallingSession
+from sqlalchemy import orm, text
+
+
+REPLICA_BIND = 'replica'
+
+LAG_QUERY = text('''
+    SELECT CASE
+        WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp())
+    END
+''')
+
+
+class ReplicaMonitor:
+    '''Decides whether the replica is fresh enough to read from. Lag is
+    measured at most once per check_interval per process. A replica that
+    lags more than max_lag seconds, or can't be reached, is skipped
+    until the next check.'''
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.checked_at = 0.0
+        self.usable = True
+
+    def replica_usable(self, engine, max_lag, check_interval):
+        now = time.monotonic()
+        if now - self.checked_at < check_interval:
+            return self.usable
+
+        with self.lock:
+            if now - self.checked_at < check_interval:
+                return self.usable
+            try:
+                with engine.connect() as connection:
+                    lag = connection.execute(LAG_QUERY).scalar()
+                self.usable = lag is None or lag <= max_lag
+            except Exception:
+                current_app.logger.warning(
+                    'read replica unreachable, reading from primary',
+                    exc_info=True)
+                self.usable = False
+            self.checked_at = now
+            return self.usable
+
+
+monitor = ReplicaMonitor()
+
+
+def read_only(view):
+    '''Let a view read from the replica. Writes, and any read after a write
+    in the same request, still go to the primary.'''
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        g.db_read_only = True
+        g.db_force_primary = bool(request.headers.get('X-Read-Primary'))
+        return view(*args, **kwargs)
+    return wrapper
+
+
+def use_replica(app):
+    if not has_request_context() or REPLICA_BIND not in (
+            app.config.get('SQLALCHEMY_BINDS') or {}):
+        return False
+    if not g.get('db_read_only') or g.get('db_wrote'):
+        return False
+    return not g.get('db_force_primary')
+
+
+class RoutingSession(SignallingSession):
+    '''Session that sends the statements of read-only requests to the
+    replica engine and everything else to the primary.'''
+
+    def __init__(self, db, **options):
+        self.db = db
+        super().__init__(db, **options)
+
+    def get_bind(self, mapper=None, clause=None, **kwargs):
+        if not self._flushing and use_replica(self.app):
+            engine = self.db.get_engine(self.app, bind=REPLICA_BIND)
+            if monitor.replica_usable(
+                    engine,
+                    self.app.config['DATABASE_REPLICA_MAX_LAG'],
+                    self.app.config['DATABASE_REPLICA_CHECK_INTERVAL']):
+                g.db_read_replica = True
+                return engine
+        return super().get_bind(mapper=mapper, clause=clause)
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+
+def mark_write(session, flush_context, instances):
+    '''before_flush listener: pin the rest of the request to the primary
+    so it reads its own writes.'''
+    if has_request_context():
+        g.db_wrote = True
@@ -0,0 +1,212 @@
+from sqlalchemy import text
+from models import db, Restaurant, Item
+
+
+class PostgresSearchBackend:
+    '''Ranks rows on the stored search_vector columns, which are generated
+    by the database and indexed with GIN (see the full text search
+    migration). text_config must match the one used there.'''
+
+    def __init__(self, text_config):
+        self.text_config = text_config
+
+    def ranked_ids(self, q, restaurant_id, limit, offset):
+        item_scope = restaurant_scope = ''
+        if restaurant_id is not None:
+            item_scope = 'AND items.restaurant_id = :restaurant_id'
+            restaurant_scope = 'AND restaurants.id = :restaurant_id'
+
+        statement = text(f'''
+            WITH query AS (
+                SELECT plainto_tsquery(CAST(:config AS regconfig), :q) AS q
+            )
+            SELECT 'item' AS kind, items.id AS id,
+                   ts_rank(items.search_vector, query.q) AS rank
+            FROM items, query
+            WHERE items.search_vector @@ query.q {item_scope}
+            UNION ALL
+            SELECT 'restaurant' AS kind, restaurants.id AS id,
+                   ts_rank(restaurants.search_vector, query.q) AS rank
+            FROM restaurants, query
+            WHERE restaurants.search_vector @@ query.q {restaurant_scope}
+            ORDER BY rank DESC, kind, id
+            LIMIT :limit OFFSET :offset
+        ''')
+
+        return db.session.execute(statement, {
+            'config': self.text_config,
+            'q': q,
+            'restaurant_id': restaurant_id,
+            'limit': limit,
+            'offset': offset
+        }).all()
+
+    def match(self, table_name, q):
+        return text(
+            f'{table_name}.search_vector @@ '
+            'plainto_tsquery(CAST(:config AS regconfig), :q)'
+        ).bindparams(config=self.text_config, q=q)
+
+
+class SQLiteSearchBackend:
+    '''FTS5 stand-in for local runs. External content tables are created
+    on first use and kept in sync with triggers.'''
+
+    SCHEMA = (
+        '''CREATE VIRTUAL TABLE IF NOT EXISTS items_fts USING fts5(
+            name, section, shortDescription,
+            content='items', content_rowid='id')''',
+        '''CREATE TRIGGER IF NOT EXISTS items_fts_insert AFTER INSERT ON items
+        BEGIN
+            INSERT INTO items_fts(rowid, name, section, shortDescription)
+            VALUES (new.id, new.name, new.section, new.shortDescription);
+        END''',
+        '''CREATE TRIGGER IF NOT EXISTS items_fts_delete AFTER DELETE ON items
+        BEGIN
+            INSERT INTO items_fts(items_fts, rowid, name, section, shortDescription)
+            VALUES ('delete', old.id, old.name, old.section, old.shortDescription);
+        END''',
+        '''CREATE TRIGGER IF NOT EXISTS items_fts_update AFTER UPDATE ON items
+        BEGIN
+            INSERT INTO items_fts(items_fts, rowid, name, section, shortDescription)
+            VALUES ('delete', old.id, old.name, old.section, old.shortDescription);
+            INSERT INTO items_fts(rowid, name, section, shortDescription)
+            VALUES (new.id, new.name, new.section, new.shortDescription);
+        END''',
+        '''CREATE VIRTUAL TABLE IF NOT EXISTS restaurants_fts USING fts5(
+            name, description,
+            content='restaurants', content_rowid='id')''',
+        '''CREATE TRIGGER IF NOT EXISTS restaurants_fts_insert AFTER INSERT ON restaurants
+        BEGIN
+            INSERT INTO restaurants_fts(rowid, name, description)
+            VALUES (new.id, new.name, new.description);
+        END''',
+        '''CREATE TRIGGER IF NOT EXISTS restaurants_fts_delete AFTER DELETE ON restaurants
+        BEGIN
+            INSERT INTO restaurants_fts(restaurants_fts, rowid, name, description)
+            VALUES ('delete', old.id, old.name, old.description);
+        END''',
+        '''CREATE TRIGGER IF NOT EXISTS restaurants_fts_update AFTER UPDATE ON restaurants
+        BEGIN
+            INSERT INTO restaurants_fts(restaurants_fts, rowid, name, description)
+            VALUES ('delete', old.id, old.name, old.description);
+            INSERT INTO restaurants_fts(rowid, name, description)
+            VALUES (new.id, new.name, new.description);
+        END''',
+        "INSERT INTO items_fts(items_fts) VALUES ('rebuild')",
+        "INSERT INTO restaurants_fts(restaurants_fts) VALUES ('rebuild')",
+    )
+
+    def __init__(self):
+        self.installed = False
+
+    def install(self):
+        with db.engine.begin() as connection:
+            for statement in self.SCHEMA:
+                connection.exec_driver_sql(statement)
+        self.installed = True
+
+    def quote(self, q):
+        '''Quote every term so user input is never parsed as FTS5
+        syntax.'''
+        return ' '.join('"{}"'.format(term.replace('"', '""'))
+                        for term in q.split())
+
+    def ranked_ids(self, q, restaurant_id, limit, offset):
+        if not self.installed:
+            self.install()
+
+        match = self.quote(q)
+
+        item_scope = restaurant_scope = ''
+        if restaurant_id is not None:
+            item_scope = 'AND items.restaurant_id = :restaurant_id'
+            restaurant_scope = 'AND restaurants.id = :restaurant_id'
+
+        statement = text(f'''
+            SELECT 'item' AS kind, items.id AS id,
+                   -bm25(items_fts, 10.0, 5.0, 1.0) AS rank
+            FROM items_fts JOIN items ON items.id = items_fts.rowid
+            WHERE items_fts MATCH :match {item_scope}
+            UNION ALL
+            SELECT 'restaurant' AS kind, restaurants.id AS id,
+                   -bm25(restaurants_fts, 10.0, 1.0) AS rank
+            FROM restaurants_fts JOIN restaurants
+                ON restaurants.id = restaurants_fts.rowid
+            WHERE restaurants_fts MATCH :match {restaurant_scope}
+            ORDER BY rank DESC, kind, id
+            LIMIT :limit OFFSET :offset
+        ''')
+
+        return db.session.execute(statement, {
+            'match': match,
+            'restaurant_id': restaurant_id,
+            'limit': limit,
+            'offset': offset
+        }).all()
+
+    def match(self, table_name, q):
+        if not self.installed:
+            self.install()
+
+        return text(
+            f'{table_name}.id IN (SELECT rowid FROM {table_name}_fts '
+            f'WHERE {table_name}_fts MATCH :match)'
+        ).bindparams(match=self.quote(q))
+
+
+class Search:
+
+    def __init__(self, app=None):
+        self.backend = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        name = app.config.get('SEARCH_BACKEND')
+        if name is None:
+            uri = app.config['SQLALCHEMY_DATABASE_URI']
+            name = 'sqlite' if uri.startswith('sqlite') else 'postgres'
+
+        if name == 'sqlite':
+            self.backend = SQLiteSearchBackend()
+        else:
+            self.backend = PostgresSearchBackend(
+                app.config.get('SEARCH_TEXT_CONFIG', 'portuguese'))
+
+    def search(self, q, limit, offset=0, restaurant_id=None):
+        '''Return one page of ranked results and the offset of the next
+        page, or None when this is the last page.'''
+        rows = self.backend.ranked_ids(q, restaurant_id, limit + 1, offset)
+
+        next_offset = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_offset = offset + limit
+
+        item_ids = [row.id for row in rows if row.kind == 'item']
+        restaurant_ids = [row.id for row in rows if row.kind == 'restaurant']
+        items = {item.id: item for item in
+                 Item.query.filter(Item.id.in_(item_ids))} if item_ids else {}
+        restaurants = {restaurant.id: restaurant for restaurant in
+                       Restaurant.query.filter(Restaurant.id.in_(restaurant_ids))
+                       } if restaurant_ids else {}
+
+        results = []
+        for row in rows:
+            if row.kind == 'item' and row.id in items:
+                results.append({'type': 'item', 'rank': row.rank,
+                                'Item': items[row.id].to_dict()})
+            elif row.kind == 'restaurant' and row.id in restaurants:
+                results.append({'type': 'restaurant', 'rank': row.rank,
+                                'Restaurant': restaurants[row.id].to_dict()})
+
+        return results, next_offset
+
+    def match(self, model, q):
+        '''Filter clause selecting the rows of model (Item or Restaurant)
+        that match q, answered from the full text index.'''
+        return self.backend.match(model.__tablename__, q)
+
+
+search = Search()
@@ -0,0 +1,42 @@
+import json
+from flask import current_app
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def dumps(data):
+    '''Encode data to JSON bytes, with orjson when it is installed.'''
+    if orjson is not None:
+        return orjson.dumps(data)
+    return json.dumps(data, separators=(',', ':')).encode('utf-8')
+
+
+def json_response(data, status=200):
+    '''jsonify for read endpoints: compact output, keys kept in the order
+    the serializers produce them.'''
+    return current_app.response_class(
+        dumps(data), status=status, mimetype='application/json')
+
+
+def serialize_row(row):
+    '''Dict for a row selected with query.with_entities(). Matches what the
+    models' to_dict() returns, without building ORM objects.'''
+    data = dict(row._mapping)
+    if data.get('price') is not None:
+        data['price'] = str(data['price'])
+    return data
+
+
+def sparse_serializer(fields):
+    '''serialize_row limited to the requested fields. Columns selected
+    only for paging (id, price) are dropped.'''
+    if fields is None:
+        return serialize_row
+
+    def serialize(row):
+        data = serialize_row(row)
+        return {field: data[field] for field in fields}
+    return serialize
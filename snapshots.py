@@ -0,0 +1,149 @@
+import os
+import json
+import time
+import shutil
+import hashlib
+from sqlalchemy.orm import joinedload
+from compression import compress, brotli
+from models import db, Restaurant
+from serializers import dumps
+
+
+MANIFEST = 'manifest.json'
+INDEX = 'index.json'
+
+
+def menu_path(slug):
+    '''Snapshot path mirroring the API URL, so nginx can serve
+    /restaurants/<slug>/menu with try_files $uri.json.'''
+    return os.path.join('restaurants', slug, 'menu.json')
+
+
+def safe_slug(slug):
+    return bool(slug) and slug not in ('.', '..') and '/' not in slug and \
+        '\\' not in slug
+
+
+def write_file(path, data):
+    '''Write through a temporary file so readers never see a partial
+    snapshot.'''
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def load_manifest(directory):
+    try:
+        with open(os.path.join(directory, MANIFEST)) as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+def encodings(precompress):
+    if not precompress:
+        return []
+    return ['gzip', 'br'] if brotli is not None else ['gzip']
+
+
+def export_snapshots(app, directory, precompress=False, batch_size=100):
+    '''Write every restaurant's menu, as served by /restaurants/<slug>/menu,
+    under directory, plus an index of all restaurants.
+
+    The manifest records the revision and content hash of each snapshot.
+    Only restaurants whose revision moved since the last run are loaded
+    again, and only files whose content changed are rewritten. Snapshots
+    of deleted restaurants are removed. Returns (written, removed).'''
+    manifest = load_manifest(directory)
+    wanted = encodings(precompress)
+    suffixes = {'gzip': '.gz', 'br': '.br'}
+
+    rows = Restaurant.query.with_entities(
+        Restaurant.id, Restaurant.slug, Restaurant.name, Restaurant.city,
+        Restaurant.state, Restaurant.revision).order_by(Restaurant.id).all()
+    rows = [row for row in rows if safe_slug(row.slug)]
+
+    # a slug can be reused, or renamed onto another restaurant, at an
+    # equal revision: compare the id too
+    stale = [row.id for row in rows
+             if manifest.get(row.slug, {}).get('id') != row.id or
+             manifest[row.slug].get('revision') != row.revision or
+             manifest[row.slug].get('encodings') != wanted]
+
+    written = 0
+    for start in range(0, len(stale), batch_size):
+        restaurants = Restaurant.query.options(
+            joinedload(Restaurant.items)).filter(
+            Restaurant.id.in_(stale[start:start + batch_size])).all()
+
+        for restaurant in restaurants:
+            body = dumps({'Restaurant': restaurant.to_menu_dict()})
+            digest = hashlib.sha1(body).hexdigest()
+            entry = manifest.get(restaurant.slug, {})
+            path = os.path.join(directory, menu_path(restaurant.slug))
+
+            if (entry.get('sha1') != digest or entry.get('encodings') != wanted
+                    or entry.get('id') != restaurant.id
+                    or not os.path.exists(path)):
+                write_file(path, body)
+                for encoding in wanted:
+                    write_file(path + suffixes[encoding],
+                               compress(body, encoding, app))
+                for encoding in set(suffixes) - set(wanted):
+                    if os.path.exists(path + suffixes[encoding]):
+                        os.remove(path + suffixes[encoding])
+                written += 1
+
+            manifest[restaurant.slug] = {
+                'id': restaurant.id,
+                'revision': restaurant.revision,
+                'sha1': digest,
+                'encodings': wanted
+            }
+
+    current = {row.slug for row in rows}
+    removed = [slug for slug in manifest if slug not in current]
+    for slug in removed:
+        shutil.rmtree(os.path.join(directory, 'restaurants', slug),
+                      ignore_errors=True)
+        del manifest[slug]
+
+    if stale or removed or not os.path.exists(
+            os.path.join(directory, INDEX)):
+        index = [
+            {
+                'id': row.id,
+                'slug': row.slug,
+                'name': row.name,
+                'city': row.city,
+                'state': row.state,
+                'revision': row.revision,
+                'sha1': manifest.get(row.slug, {}).get('sha1'),
+                'menu': '/' + menu_path(row.slug).replace(os.sep, '/')
+            }
+            for row in rows
+        ]
+        write_file(os.path.join(directory, INDEX),
+                   dumps({'Restaurants': index}))
+
+    write_file(os.path.join(directory, MANIFEST),
+               json.dumps(manifest, indent=2).encode('utf-8'))
+    return written, len(removed)
+
+
+def watch_snapshots(app, directory, precompress=False, interval=5):
+    '''Export again whenever the catalog version changes. Writes from any
+    process bump restaurant revisions, so polling the summary is enough
+    to pick them up.'''
+    version = None
+    while True:
+        current = tuple(Restaurant.get_catalog_version())
+        if current != version:
+            written, removed = export_snapshots(app, directory, precompress)
+            app.logger.info('snapshots: %d written, %d removed',
+                            written, removed)
+            version = current
+        db.session.remove()
+        time.sleep(interval)
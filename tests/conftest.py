@@ -0,0 +1,70 @@
+import os
+import sys
+import tempfile
+import threading
+import pytest
+
+# models.py and config.py read the environment on import
+os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(
+    tempfile.mkdtemp(), 'menu-api.db')
+os.environ['METRICS_ENABLED'] = 'false'
+os.environ['BCRYPT_WORKERS'] = '0'
+os.environ['BCRYPT_LOG_ROUNDS'] = '4'
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+
+import app as app_module  # noqa: E402
+from cache import cache  # noqa: E402
+from events import menu_events  # noqa: E402
+from models import db, user_cache  # noqa: E402
+from search import search  # noqa: E402
+
+
+@pytest.fixture
+def app():
+    '''The app on an empty database. No app context is left pushed, so
+    every request gets its own g; tests that touch the models open one
+    with app.app_context().'''
+    app = app_module.app
+    app.config.update(TESTING=True, WTF_CSRF_ENABLED=False,
+                      SSE_ENABLED=True)
+
+    with app.app_context():
+        # the FTS tables are not part of the metadata
+        with db.engine.begin() as connection:
+            connection.exec_driver_sql('DROP TABLE IF EXISTS items_fts')
+            connection.exec_driver_sql('DROP TABLE IF EXISTS restaurants_fts')
+        db.drop_all()
+        db.create_all()
+    search.backend.installed = False
+    cache.clear()
+    user_cache.backend.clear()
+    menu_events.broker.history.clear()
+    menu_events.streams = threading.BoundedSemaphore(
+        app.config['SSE_MAX_STREAMS'])
+
+    yield app
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def make_restaurant(client):
+    '''Create a restaurant and its items through the API.'''
+    def make_restaurant(slug, items=(), **fields):
+        fields.setdefault('name', slug.replace('-', ' ').title())
+        response = client.post('/restaurants', json=dict(fields, slug=slug))
+        assert response.status_code == 200
+        restaurant = response.get_json()['created restaurant']
+
+        restaurant['items'] = []
+        for item in items:
+            response = client.post(
+                f"/restaurants/{restaurant['id']}/items", json=item)
+            assert response.status_code == 200
+            restaurant['items'].append(response.get_json()['created item'])
+        return restaurant
+
+    return make_restaurant
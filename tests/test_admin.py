@@ -0,0 +1,106 @@
+import pytest
+from app import bcrypt
+from models import db, Restaurant, User
+
+
+@pytest.fixture
+def admin(app, client):
+    with app.app_context():
+        db.session.add(User(
+            username='admin', email='admin@example.com',
+            password=bcrypt.generate_password_hash('password', 4)))
+        db.session.commit()
+
+    response = client.post('/login', data={
+        'email': 'admin@example.com', 'password': 'password'})
+    assert response.status_code == 302
+    return client
+
+
+def menu_document_items(app, slug):
+    with app.app_context():
+        document = Restaurant.query.filter_by(slug=slug).one().menu_document
+    return [item['name'] for section in document['sections']
+            for item in section['items']]
+
+
+def menu_items(client, slug):
+    menu = client.get(f'/restaurants/{slug}/menu').get_json()['Restaurant']
+    return [item['name'] for section in menu['sections']
+            for item in section['items']]
+
+
+def item_form(restaurant, **fields):
+    return dict({'section': 'Paes', 'name': 'Pao italiano',
+                 'shortDescription': '', 'price': '19.90', 'imageUrl': '',
+                 'restaurant': str(restaurant['id'])}, **fields)
+
+
+def test_admin_needs_a_login(client):
+    response = client.get('/admin/item/')
+
+    assert response.status_code == 302
+    assert '/login' in response.location
+
+
+def test_admin_created_item_reaches_the_menu(app, admin, make_restaurant):
+    restaurant = make_restaurant('padaria', [{'name': 'Broa', 'price': '8'}])
+    revision = admin.get('/restaurants/padaria/menu?since=0').get_json()[
+        'revision']
+    assert menu_items(admin, 'padaria') == ['Broa']
+
+    response = admin.post('/admin/item/new/', data=item_form(restaurant))
+
+    assert response.status_code == 302
+    assert menu_document_items(app, 'padaria') == ['Broa', 'Pao italiano']
+    assert menu_items(admin, 'padaria') == ['Broa', 'Pao italiano']
+    delta = admin.get(f'/restaurants/padaria/menu?since={revision}').get_json()
+    assert [item['name'] for item in delta['Items']] == ['Pao italiano']
+
+
+def test_admin_edited_item_reaches_the_menu(app, admin, make_restaurant):
+    restaurant = make_restaurant('padaria', [
+        {'section': 'Paes', 'name': 'Pao italiano', 'price': '19.90'}])
+    item = restaurant['items'][0]
+    assert menu_items(admin, 'padaria') == ['Pao italiano']
+
+    response = admin.post(
+        f"/admin/item/edit/?id={item['id']}",
+        data=item_form(restaurant, name='Pao de fermentacao'))
+
+    assert response.status_code == 302
+    assert menu_document_items(app, 'padaria') == ['Pao de fermentacao']
+    assert menu_items(admin, 'padaria') == ['Pao de fermentacao']
+
+
+def test_admin_moved_item_reaches_both_menus(app, admin, make_restaurant):
+    padaria = make_restaurant('padaria', [
+        {'section': 'Paes', 'name': 'Pao italiano', 'price': '19.90'}])
+    confeitaria = make_restaurant('confeitaria', [
+        {'section': 'Doces', 'name': 'Sonho', 'price': '7.50'}])
+    item = padaria['items'][0]
+    menu_items(admin, 'padaria')
+    menu_items(admin, 'confeitaria')
+
+    response = admin.post(f"/admin/item/edit/?id={item['id']}",
+                          data=item_form(confeitaria))
+
+    assert response.status_code == 302
+    assert menu_document_items(app, 'padaria') == []
+    assert menu_document_items(app, 'confeitaria') == [
+        'Pao italiano', 'Sonho']
+    assert menu_items(admin, 'padaria') == []
+    assert menu_items(admin, 'confeitaria') == ['Pao italiano', 'Sonho']
+
+
+def test_admin_deleted_item_leaves_the_menu(app, admin, make_restaurant):
+    restaurant = make_restaurant('padaria', [
+        {'name': 'Broa', 'price': '8'}, {'name': 'Sonho', 'price': '7.50'}])
+    menu_items(admin, 'padaria')
+
+    response = admin.post('/admin/item/delete/', data={
+        'id': str(restaurant['items'][0]['id'])})
+
+    assert response.status_code == 302
+    assert menu_document_items(app, 'padaria') == ['Sonho']
+    assert menu_items(admin, 'padaria') == ['Sonho']
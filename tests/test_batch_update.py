@@ -0,0 +1,88 @@
+ITEMS = [
+    {'section': 'Paes', 'name': 'Pao italiano', 'price': '19.90'},
+    {'section': 'Paes', 'name': 'Baguete', 'price': '12.90'},
+    {'section': 'Doces', 'name': 'Sonho', 'price': '7.50'},
+]
+
+
+def menu_prices(client, slug):
+    menu = client.get(f'/restaurants/{slug}/menu').get_json()['Restaurant']
+    return {item['name']: item['price'] for section in menu['sections']
+            for item in section['items']}
+
+
+def test_batch_update(client, make_restaurant):
+    restaurant = make_restaurant('padaria', ITEMS)
+    pao, baguete, sonho = restaurant['items']
+    revision = client.get('/restaurants/padaria/menu?since=0').get_json()[
+        'revision']
+    menu_prices(client, 'padaria')
+
+    response = client.patch(f"/restaurants/{restaurant['id']}/items", json=[
+        {'id': sonho['id'], 'price': '8.00', 'section': 'Doces finos'},
+        {'id': pao['id'], 'price': '21.90'},
+        {'id': baguete['id'], 'price': '12.90'},
+    ])
+
+    assert response.status_code == 200
+    body = response.get_json()
+    assert body['success'] is True
+    # unchanged rows are left out
+    assert [(item['id'], item['price']) for item in body['updated']] == [
+        (pao['id'], '21.90'), (sonho['id'], '8.00')]
+    assert menu_prices(client, 'padaria') == {
+        'Pao italiano': '21.90', 'Baguete': '12.90', 'Sonho': '8.00'}
+
+    # the whole batch is one revision
+    delta = client.get(
+        f'/restaurants/padaria/menu?since={revision}').get_json()
+    assert delta['revision'] == revision + 1
+    assert [item['id'] for item in delta['Items']] == [pao['id'], sonho['id']]
+
+
+def test_batch_update_is_all_or_nothing(client, make_restaurant):
+    restaurant = make_restaurant('padaria', ITEMS)
+    other = make_restaurant('confeitaria', [{'name': 'Bolo', 'price': '30'}])
+    pao = restaurant['items'][0]
+    before = menu_prices(client, 'padaria')
+
+    response = client.patch(f"/restaurants/{restaurant['id']}/items", json=[
+        {'id': pao['id'], 'price': '21.90'},
+        {'id': other['items'][0]['id'], 'price': '1.00'},
+    ])
+
+    assert response.status_code == 422
+    body = response.get_json()
+    assert body['updated'] == []
+    assert body['errors'] == [{'id': other['items'][0]['id'],
+                               'error': 'item not found in this restaurant'}]
+    assert menu_prices(client, 'padaria') == before
+    assert menu_prices(client, 'confeitaria') == {'Bolo': '30.00'}
+
+
+def test_batch_update_reports_every_bad_row(client, make_restaurant):
+    restaurant = make_restaurant('padaria', ITEMS)
+    pao, baguete, sonho = restaurant['items']
+
+    response = client.patch(f"/restaurants/{restaurant['id']}/items", json=[
+        {'price': '1.00'},
+        {'id': pao['id'], 'price': '2.00'},
+        {'id': pao['id'], 'price': '3.00'},
+        {'id': sonho['id'], 'price': 'caro'},
+        {'id': True, 'name': 'Pao'},
+    ])
+
+    assert response.status_code == 422
+    assert [error['row'] for error in response.get_json()['errors']] == [
+        0, 2, 3, 4]
+    assert menu_prices(client, 'padaria')['Pao italiano'] == '19.90'
+
+
+def test_batch_update_needs_a_list(client, make_restaurant):
+    restaurant = make_restaurant('padaria', ITEMS)
+
+    response = client.patch(f"/restaurants/{restaurant['id']}/items",
+                            json={'id': restaurant['items'][0]['id']})
+    assert response.status_code == 400
+    response = client.patch('/restaurants/999/items', json=[])
+    assert response.status_code == 404
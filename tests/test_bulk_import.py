@@ -0,0 +1,98 @@
+import io
+
+CSV = '''section,name,price,categories
+Paes,Pao italiano,19.90,vegano|sem lactose
+Doces,Sonho,"7,50",
+'''
+
+
+def menu_items(client, slug):
+    menu = client.get(f'/restaurants/{slug}/menu').get_json()['Restaurant']
+    return [item for section in menu['sections'] for item in section['items']]
+
+
+def test_bulk_import_json(client, make_restaurant):
+    restaurant = make_restaurant('padaria')
+    menu_items(client, 'padaria')
+
+    response = client.post(f"/restaurants/{restaurant['id']}/items/bulk",
+                           json=[
+                               {'name': 'Pao italiano', 'price': '19.90'},
+                               {'name': 'Broa', 'price': 'barato'},
+                               {'name': 'Sonho', 'price': 7.5,
+                                'categories': ['doce']},
+                               {'price': '1.00', 'name': 5},
+                           ])
+
+    assert response.status_code == 200
+    body = response.get_json()
+    assert body['success'] is True
+    assert body['created'] == 2
+    assert [error['row'] for error in body['errors']] == [1, 3]
+    assert [(item['name'], item['price'], item['categories'])
+            for item in menu_items(client, 'padaria')] == [
+        ('Pao italiano', '19.90', None), ('Sonho', '7.50', ['doce'])]
+
+
+def test_bulk_import_csv(client, make_restaurant):
+    restaurant = make_restaurant('padaria')
+
+    response = client.post(f"/restaurants/{restaurant['id']}/items/bulk",
+                           data=CSV, content_type='text/csv')
+
+    assert response.status_code == 200
+    assert response.get_json()['created'] == 2
+    assert [(item['section'], item['price'], item['categories'])
+            for item in menu_items(client, 'padaria')] == [
+        ('Paes', '19.90', ['vegano', 'sem lactose']), ('Doces', '7.50', None)]
+
+
+def test_bulk_import_upload(client, make_restaurant):
+    restaurant = make_restaurant('padaria')
+
+    response = client.post(
+        f"/restaurants/{restaurant['id']}/items/bulk",
+        data={'file': (io.BytesIO(b'\xef\xbb\xbf' + CSV.encode()),
+                       'menu.csv')},
+        content_type='multipart/form-data')
+
+    assert response.status_code == 200
+    assert [item['name'] for item in menu_items(client, 'padaria')] == [
+        'Pao italiano', 'Sonho']
+
+
+def test_bulk_import_is_one_revision(client, make_restaurant):
+    restaurant = make_restaurant('padaria')
+    revision = client.get('/restaurants/padaria/menu?since=0').get_json()[
+        'revision']
+
+    client.post(f"/restaurants/{restaurant['id']}/items/bulk",
+                data=CSV, content_type='text/csv')
+
+    delta = client.get(
+        f'/restaurants/padaria/menu?since={revision}').get_json()
+    assert delta['revision'] == revision + 1
+    assert len(delta['Items']) == 2
+    assert len(client.get('/items').get_json()['Items']) == 2
+    assert len(client.get('/search?q=sonho').get_json()['Results']) == 1
+
+
+def test_bulk_import_with_no_valid_row(client, make_restaurant):
+    restaurant = make_restaurant('padaria')
+
+    response = client.post(f"/restaurants/{restaurant['id']}/items/bulk",
+                           json=[{'name': 'Broa', 'price': 'barato'}])
+
+    assert response.status_code == 422
+    assert response.get_json()['created'] == 0
+    assert menu_items(client, 'padaria') == []
+
+
+def test_bulk_import_bad_requests(client, make_restaurant):
+    restaurant = make_restaurant('padaria')
+
+    response = client.post(f"/restaurants/{restaurant['id']}/items/bulk",
+                           json={'name': 'Broa'})
+    assert response.status_code == 400
+    response = client.post('/restaurants/999/items/bulk', json=[])
+    assert response.status_code == 404
@@ -0,0 +1,114 @@
+import json
+import threading
+import pytest
+from events import menu_events
+
+ITEMS = [{'section': 'Paes', 'name': 'Pao italiano', 'price': '19.90'}]
+
+
+@pytest.fixture(autouse=True)
+def heartbeat(monkeypatch):
+    monkeypatch.setattr(menu_events, 'heartbeat', 0.01)
+
+
+def open_stream(client, slug, **headers):
+    response = client.get(f'/restaurants/{slug}/menu/stream', headers=headers)
+    assert response.status_code == 200
+    assert response.mimetype == 'text/event-stream'
+    return response, iter(response.response)
+
+
+def read_events(chunks, count):
+    '''The next count events, as (name, id, data), past heartbeats.'''
+    events = []
+    for _ in range(count + 100):
+        chunk = next(chunks).decode()
+        if chunk.startswith((':', 'retry:')):
+            continue
+        fields = dict(line.split(': ', 1)
+                      for line in chunk.strip().split('\n'))
+        events.append((fields['event'], int(fields['id']),
+                       json.loads(fields['data'])))
+        if len(events) == count:
+            return events
+    raise AssertionError(f'only {len(events)} of {count} events sent')
+
+
+def test_stream_resumes_from_last_event_id(client, make_restaurant):
+    restaurant = make_restaurant('padaria', ITEMS)
+    item = restaurant['items'][0]
+    client.patch(f"/items/{item['id']}", json={'price': '21.90'})
+
+    response, chunks = open_stream(client, 'padaria', **{'Last-Event-ID': '1'})
+    try:
+        replayed = read_events(chunks, 2)
+        assert [(name, event_id) for name, event_id, data in replayed] == [
+            ('menu', 2), ('menu', 3)]
+        assert [change['action'] for name, event_id, data in replayed
+                for change in data['changes']] == ['created', 'updated']
+
+        client.delete(f"/items/{item['id']}")
+
+        [(name, event_id, data)] = read_events(chunks, 1)
+        assert (name, event_id) == ('menu', 4)
+        assert data['changes'] == [
+            {'type': 'item', 'action': 'deleted', 'Item': {'id': item['id']}}]
+    finally:
+        response.close()
+
+
+def test_stream_starts_at_the_current_revision(client, make_restaurant):
+    restaurant = make_restaurant('padaria', ITEMS)
+
+    response, chunks = open_stream(client, 'padaria')
+    try:
+        assert next(chunks) == b'retry: 3000\n\n'
+        assert next(chunks) == b': heartbeat\n\n'
+
+        client.patch(f"/items/{restaurant['items'][0]['id']}",
+                     json={'price': '21.90'})
+
+        assert [(name, event_id) for name, event_id, data in
+                read_events(chunks, 1)] == [('menu', 3)]
+    finally:
+        response.close()
+
+
+def test_stream_resets_when_history_is_missing(client, make_restaurant):
+    make_restaurant('padaria', ITEMS)
+    menu_events.broker.history.clear()
+
+    response, chunks = open_stream(client, 'padaria', **{'Last-Event-ID': '1'})
+    try:
+        assert read_events(chunks, 1) == [
+            ('reset', 2, {'slug': 'padaria', 'revision': 2})]
+    finally:
+        response.close()
+
+
+def test_stream_bad_requests(app, client, make_restaurant):
+    make_restaurant('padaria')
+
+    response = client.get('/restaurants/padaria/menu/stream',
+                          headers={'Last-Event-ID': 'x'})
+    assert response.status_code == 400
+    assert client.get('/restaurants/nowhere/menu/stream').status_code == 404
+
+    app.config['SSE_ENABLED'] = False
+    assert client.get('/restaurants/padaria/menu/stream').status_code == 503
+
+
+def test_streams_are_capped(client, make_restaurant):
+    make_restaurant('padaria')
+    menu_events.streams = threading.BoundedSemaphore(1)
+
+    first, chunks = open_stream(client, 'padaria')
+    next(chunks)
+    refused = client.get('/restaurants/padaria/menu/stream')
+    assert refused.status_code == 503
+    assert refused.headers['Retry-After'] == '1'
+
+    first.close()
+
+    second, chunks = open_stream(client, 'padaria')
+    second.close()
@@ -0,0 +1,136 @@
+from models import db, Item, Restaurant
+
+ITEMS = [
+    {'section': 'Paes', 'name': 'Pao italiano', 'price': '19.90'},
+    {'section': 'Paes', 'name': 'Baguete', 'price': '12.90'},
+]
+
+
+def changes(client, slug, since):
+    response = client.get(f'/restaurants/{slug}/menu?since={since}')
+    assert response.status_code == 200
+    return response.get_json()
+
+
+def test_changes_since_a_revision(client, make_restaurant):
+    restaurant = make_restaurant('padaria', ITEMS)
+    kept, changed = restaurant['items']
+    revision = changes(client, 'padaria', 0)['revision']
+
+    client.patch(f"/items/{changed['id']}", json={'price': '13.90'})
+    created = client.post(f"/restaurants/{restaurant['id']}/items", json={
+        'name': 'Broa', 'price': '8.00'}).get_json()['created item']
+    client.delete(f"/items/{kept['id']}")
+
+    delta = changes(client, 'padaria', revision)
+    assert delta['since'] == revision
+    assert delta['revision'] == revision + 3
+    assert [(item['id'], item['price']) for item in delta['Items']] == [
+        (changed['id'], '13.90'), (created['id'], '8.00')]
+    assert delta['deleted'] == [kept['id']]
+
+    assert changes(client, 'padaria', delta['revision']) == dict(
+        delta, since=delta['revision'], Items=[], deleted=[])
+
+
+def test_changes_from_zero_hold_the_whole_menu(client, make_restaurant):
+    restaurant = make_restaurant('padaria', ITEMS)
+
+    delta = changes(client, 'padaria', 0)
+
+    assert [item['id'] for item in delta['Items']] == [
+        item['id'] for item in restaurant['items']]
+    assert delta['deleted'] == []
+
+
+def test_changes_are_tagged(client, make_restaurant):
+    make_restaurant('padaria', ITEMS)
+    response = client.get('/restaurants/padaria/menu?since=1')
+
+    again = client.get('/restaurants/padaria/menu?since=1', headers={
+        'If-None-Match': response.headers['ETag']})
+
+    assert again.status_code == 304
+
+
+def test_bad_since(client, make_restaurant):
+    make_restaurant('padaria', ITEMS)
+
+    assert client.get('/restaurants/padaria/menu?since=-1').status_code == 400
+    assert client.get('/restaurants/padaria/menu?since=x').status_code == 400
+    assert client.get('/restaurants/nowhere/menu?since=0').status_code == 404
+
+
+def move_and_check(app, client, move):
+    '''Move the first item of padaria to confeitaria with move(item,
+    confeitaria) and check both deltas and menus see it.'''
+    padaria = [item['id'] for item in changes(client, 'padaria', 0)['Items']]
+    since = {slug: changes(client, slug, 0)['revision']
+             for slug in ('padaria', 'confeitaria')}
+    client.get('/restaurants/padaria/menu')
+    client.get('/restaurants/confeitaria/menu')
+
+    with app.app_context():
+        item = db.session.get(Item, padaria[0])
+        move(item, Restaurant.query.filter_by(slug='confeitaria').one())
+        db.session.commit()
+
+    old = changes(client, 'padaria', since['padaria'])
+    new = changes(client, 'confeitaria', since['confeitaria'])
+    assert old['revision'] == since['padaria'] + 1
+    assert old['deleted'] == [padaria[0]]
+    assert new['revision'] == since['confeitaria'] + 1
+    assert [item['id'] for item in new['Items']] == [padaria[0]]
+
+    menu = client.get('/restaurants/padaria/menu').get_json()['Restaurant']
+    assert [item['id'] for section in menu['sections']
+            for item in section['items']] == padaria[1:]
+    menu = client.get('/restaurants/confeitaria/menu').get_json()['Restaurant']
+    assert [item['id'] for section in menu['sections']
+            for item in section['items']] == [padaria[0]]
+
+
+def test_move_by_column(app, client, make_restaurant):
+    make_restaurant('padaria', ITEMS)
+    make_restaurant('confeitaria')
+
+    def move(item, restaurant):
+        item.restaurant_id = restaurant.id
+
+    move_and_check(app, client, move)
+
+
+def test_move_by_relationship(app, client, make_restaurant):
+    make_restaurant('padaria', ITEMS)
+    make_restaurant('confeitaria')
+
+    def move(item, restaurant):
+        item.restaurant = restaurant
+
+    move_and_check(app, client, move)
+
+
+def test_move_by_collection(app, client, make_restaurant):
+    make_restaurant('padaria', ITEMS)
+    make_restaurant('confeitaria')
+
+    def move(item, restaurant):
+        restaurant.items.append(item)
+
+    move_and_check(app, client, move)
+
+
+def test_item_added_by_relationship(app, client, make_restaurant):
+    make_restaurant('padaria', ITEMS)
+    since = changes(client, 'padaria', 0)['revision']
+
+    with app.app_context():
+        restaurant = Restaurant.query.filter_by(slug='padaria').one()
+        item = Item(name='Broa', price=8, restaurant=restaurant)
+        db.session.add(item)
+        db.session.commit()
+        item_id = item.id
+
+    delta = changes(client, 'padaria', since)
+    assert delta['revision'] == since + 1
+    assert [item['id'] for item in delta['Items']] == [item_id]
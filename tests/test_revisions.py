@@ -0,0 +1,121 @@
+from models import db, Item, Restaurant
+
+ITEMS = [{'section': 'Paes', 'name': 'Pao italiano', 'price': '19.90'}]
+
+
+def get_again(client, path, response):
+    return client.get(path, headers={
+        'If-None-Match': response.headers['ETag']})
+
+
+def test_unchanged_menu_is_not_modified(client, make_restaurant):
+    make_restaurant('padaria', ITEMS)
+    response = client.get('/restaurants/padaria/menu')
+
+    assert response.status_code == 200
+    assert response.headers['ETag']
+    assert response.headers['Last-Modified']
+    again = get_again(client, '/restaurants/padaria/menu', response)
+    assert again.status_code == 304
+    assert again.headers['ETag'] == response.headers['ETag']
+    assert again.data == b''
+
+    since = client.get('/restaurants/padaria/menu', headers={
+        'If-Modified-Since': response.headers['Last-Modified']})
+    assert since.status_code == 304
+
+
+def test_item_writes_change_the_menu_etag(client, make_restaurant):
+    restaurant = make_restaurant('padaria', ITEMS)
+    item = restaurant['items'][0]
+    response = client.get('/restaurants/padaria/menu')
+
+    client.patch(f"/items/{item['id']}", json={'price': '21.90'})
+
+    changed = get_again(client, '/restaurants/padaria/menu', response)
+    assert changed.status_code == 200
+    assert changed.headers['ETag'] != response.headers['ETag']
+    [section] = changed.get_json()['Restaurant']['sections']
+    assert section['items'][0]['price'] == '21.90'
+
+
+def test_etag_depends_on_the_query(client, make_restaurant):
+    make_restaurant('padaria', ITEMS)
+    menu = client.get('/restaurants/padaria/menu')
+    sorted_menu = client.get('/restaurants/padaria/menu?sort=price')
+
+    assert menu.headers['ETag'] != sorted_menu.headers['ETag']
+    again = get_again(client, '/restaurants/padaria/menu?sort=price', menu)
+    assert again.status_code == 200
+
+
+def test_reused_slug_is_never_not_modified(client, make_restaurant):
+    old = make_restaurant('padaria', name='Padaria Velha')
+    response = client.get('/restaurants/padaria')
+    assert client.delete(f"/restaurants/{old['id']}").status_code == 200
+
+    new = make_restaurant('padaria', name='Padaria Nova')
+
+    again = get_again(client, '/restaurants/padaria', response)
+    assert again.status_code == 200
+    assert again.get_json()['Restaurant'][0]['name'] == 'Padaria Nova'
+    assert again.get_json()['Restaurant'][0]['id'] == new['id']
+
+
+def test_restaurant_moving_slug_is_served_fresh(app, client, make_restaurant):
+    first = make_restaurant('padaria', name='Padaria')
+    make_restaurant('confeitaria', name='Confeitaria')
+    response = client.get('/restaurants/padaria')
+
+    with app.app_context():
+        db.session.get(Restaurant, first['id']).slug = 'padaria-antiga'
+        db.session.commit()
+        confeitaria = Restaurant.query.filter_by(slug='confeitaria').one()
+        confeitaria.slug = 'padaria'
+        db.session.commit()
+
+    again = get_again(client, '/restaurants/padaria', response)
+    assert again.status_code == 200
+    assert again.get_json()['Restaurant'][0]['name'] == 'Confeitaria'
+
+
+def test_list_etag_follows_the_catalog(client, make_restaurant):
+    make_restaurant('padaria', ITEMS)
+    scratch = make_restaurant('scratch')
+    restaurants = client.get('/restaurants')
+    items = client.get('/items')
+    assert get_again(client, '/restaurants', restaurants).status_code == 304
+
+    assert client.delete(f"/restaurants/{scratch['id']}").status_code == 200
+
+    again = get_again(client, '/restaurants', restaurants)
+    assert again.status_code == 200
+    assert [r['slug'] for r in again.get_json()['Restaurants']] == ['padaria']
+    # one revision covers the whole catalog, item lists included
+    assert get_again(client, '/items', items).status_code == 200
+
+
+def test_list_and_api_follow_item_writes(client, make_restaurant):
+    restaurant = make_restaurant('padaria', ITEMS)
+    items = client.get('/items')
+    assert len(client.get('/api').get_json()['Items']) == 1
+
+    client.post(f"/restaurants/{restaurant['id']}/items",
+                json={'name': 'Broa', 'price': '8.00'})
+
+    again = get_again(client, '/items', items)
+    assert again.status_code == 200
+    assert len(again.get_json()['Items']) == 2
+    assert len(client.get('/api').get_json()['Items']) == 2
+
+
+def test_revision_counts_menu_writes(app, client, make_restaurant):
+    restaurant = make_restaurant('padaria', ITEMS)
+    item = restaurant['items'][0]
+
+    client.patch(f"/items/{item['id']}", json={'price': '21.90'})
+    client.delete(f"/items/{item['id']}")
+
+    with app.app_context():
+        assert Restaurant.query.get(restaurant['id']).revision == 4
+        assert Item.query.count() == 0
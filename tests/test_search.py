@@ -0,0 +1,84 @@
+PIZZERIA = [
+    {'section': 'Pizzas', 'name': 'Pizza margherita', 'price': '49.90',
+     'shortDescription': 'Molho de tomate, mussarela e manjericao'},
+    {'section': 'Pizzas', 'name': 'Pizza calabresa', 'price': '52.90'},
+    {'section': 'Bebidas', 'name': 'Suco de laranja', 'price': '12.00'},
+]
+
+
+def test_search_ranks_items_and_restaurants(client, make_restaurant):
+    make_restaurant('forno-da-pizza', PIZZERIA, name='Forno da Pizza')
+    make_restaurant('padaria', [{'name': 'Pao frances', 'price': '1.00'}])
+
+    response = client.get('/search?q=pizza')
+
+    assert response.status_code == 200
+    results = response.get_json()['Results']
+    assert {(r['type'], (r.get('Item') or r.get('Restaurant'))['name'])
+            for r in results} == {
+        ('item', 'Pizza margherita'),
+        ('item', 'Pizza calabresa'),
+        ('restaurant', 'Forno da Pizza'),
+    }
+    ranks = [result['rank'] for result in results]
+    assert ranks == sorted(ranks, reverse=True)
+
+
+def test_search_matches_descriptions(client, make_restaurant):
+    make_restaurant('forno-da-pizza', PIZZERIA)
+
+    results = client.get('/search?q=manjericao').get_json()['Results']
+
+    assert [r['Item']['name'] for r in results] == ['Pizza margherita']
+
+
+def test_search_pages(client, make_restaurant):
+    make_restaurant('forno-da-pizza', PIZZERIA)
+
+    first = client.get('/search?q=pizza&limit=1').get_json()
+    second = client.get(
+        f"/search?q=pizza&limit=1&after={first['next_cursor']}").get_json()
+    last = client.get('/search?q=pizza&limit=1&after=2').get_json()
+
+    assert first['next_cursor'] == '1'
+    assert second['next_cursor'] == '2'
+    assert last['next_cursor'] is None
+    assert first['Results'] != second['Results']
+
+
+def test_search_by_restaurant(client, make_restaurant):
+    make_restaurant('forno-da-pizza', PIZZERIA)
+    other = make_restaurant('outra-pizzaria', [
+        {'name': 'Pizza portuguesa', 'price': '55.00'}])
+
+    response = client.get(f"/search?q=pizza&restaurant_id={other['id']}")
+
+    assert [r['Item']['name'] for r in response.get_json()['Results']] == [
+        'Pizza portuguesa']
+
+
+def test_search_follows_writes(client, make_restaurant):
+    restaurant = make_restaurant('forno-da-pizza', PIZZERIA)
+    client.get('/search?q=pizza')
+    item = restaurant['items'][2]
+
+    client.patch(f"/items/{item['id']}", json={'name': 'Pizza doce'})
+    client.delete(f"/items/{restaurant['items'][0]['id']}")
+
+    results = client.get('/search?q=pizza').get_json()['Results']
+    names = {r['Item']['name'] for r in results if r['type'] == 'item'}
+    assert names == {'Pizza calabresa', 'Pizza doce'}
+
+
+def test_search_quotes_user_input(client, make_restaurant):
+    make_restaurant('forno-da-pizza', PIZZERIA)
+
+    response = client.get('/search', query_string={'q': 'pizza" OR *'})
+
+    assert response.status_code == 200
+    assert response.get_json()['Results'] == []
+
+
+def test_search_requires_a_query(client):
+    assert client.get('/search').status_code == 400
+    assert client.get('/search?q=%20').status_code == 400